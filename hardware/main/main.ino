@@ -11,12 +11,15 @@
 #include <ArduinoJson.h>
 #include <WiFiManager.h> // Cần cài thư viện WiFiManager by tzapu
 #include <Preferences.h> // Thư viện lưu trữ vào Flash (có sẵn trong ESP32 Core)
+#include <time.h>
 
 // --- CẤU HÌNH MẶC ĐỊNH ---
 // Các giá trị này sẽ hiển thị gợi ý trong trang cấu hình
 char server_ip[40] = "192.168.0.101"; 
 char server_port[6] = "5000";
 char device_token[40] = "my_secret_device_token_12345";
+char gate_id[16] = "default";  // Mã cổng, vd "G1"
+char lane_id[16] = "";         // Làn trong cổng, vd "in" / "out" (bỏ trống nếu cổng chỉ có một làn)
 
 // --- KHỞI TẠO CÁC ĐỐI TƯỢNG ---
 Preferences preferences; // Để lưu IP Server vào bộ nhớ máy
@@ -25,6 +28,14 @@ WiFiManager wm;          // Quản lý kết nối WiFi
 // --- API Endpoints ---
 const char* API_DEVICE_SCAN = "/api/gate/device_scan";
 const char* API_CHECK_STATUS = "/api/gate/check_action_status";
+const char* API_WAIT_STATUS = "/api/gate/wait_action_status";
+const char* API_DEVICE_SCAN_BATCH = "/api/gate/device_scan_batch";
+
+// --- Chế độ chờ duyệt ---
+// 1: Long-poll (server giữ request tới khi bảo vệ duyệt, mở cổng gần như tức thì)
+// 0: Polling cũ, hỏi server mỗi POLLING_INTERVAL
+#define USE_LONG_POLL 1
+const int LONG_POLL_WAIT_S = 25;  // Không vượt quá LONGPOLL_MAX_TIMEOUT của server
 
 // --- RFID pins ---
 #define SS_PIN  5
@@ -47,6 +58,21 @@ int gatePhase = 0;
 // --- Cooldown & Polling ---
 unsigned long lastTriggerTime = 0;
 const unsigned long COOL_DOWN_MS = 3000UL;
+// Gửi lại tối đa chừng này lần khi lỗi HTTP; cùng idempotency_key nên server không tạo yêu cầu trùng.
+const int SCAN_RETRIES = 2;
+
+// --- Bộ đệm lượt quẹt khi mất WiFi ---
+// Giữ trong RAM (mất khi khởi động lại), gửi cả lô lên server khi có mạng lại.
+// Chỉ ghi khi đồng hồ đã đồng bộ NTP, vì server cần giờ quẹt thật.
+#define MAX_OFFLINE_SWIPES 50
+const unsigned long OFFLINE_FLUSH_INTERVAL_MS = 10000UL;
+struct OfflineSwipe {
+  char cardId[32];
+  time_t ts;
+};
+OfflineSwipe offlineSwipes[MAX_OFFLINE_SWIPES];
+int offlineCount = 0;
+unsigned long lastFlushAttempt = 0;
 
 enum State {
   STATE_IDLE,    
@@ -75,6 +101,8 @@ void handleIdleState();
 void handlePollingState(); 
 void startPolling(int pollId);
 void stopPolling();
+void bufferOfflineSwipe(const String& cardUid);
+void flushOfflineSwipes();
 
 void setup() {
   Serial.begin(115200);
@@ -99,15 +127,20 @@ void setup() {
     String load_ip = preferences.getString("server_ip", "192.168.0.101");
     String load_port = preferences.getString("server_port", "5000");
     String load_token = preferences.getString("device_token", "my_secret_device_token_12345");
+    String load_gate = preferences.getString("gate_id", "default");
+    String load_lane = preferences.getString("lane_id", "");
   
     load_ip.toCharArray(server_ip, 40);
     load_port.toCharArray(server_port, 6);
     load_token.toCharArray(device_token, 40);
+    load_gate.toCharArray(gate_id, 16);
+    load_lane.toCharArray(lane_id, 16);
   }
   
   Serial.println("--- Current Config ---");
   Serial.printf("Server IP: %s\n", server_ip);
   Serial.printf("Port: %s\n", server_port);
+  Serial.printf("Gate/Lane: %s/%s\n", gate_id, lane_id);
   Serial.println("----------------------");
   
   preferences.end(); // <--- QUAN TRỌNG: Đóng lại ngay sau khi đọc
@@ -121,10 +154,14 @@ void setup() {
   WiFiManagerParameter custom_server_ip("server_ip", "IP May Chu", server_ip, 40);
   WiFiManagerParameter custom_server_port("server_port", "Port", server_port, 6);
   WiFiManagerParameter custom_device_token("device_token", "Device Token", device_token, 40);
+  WiFiManagerParameter custom_gate_id("gate_id", "Ma Cong", gate_id, 16);
+  WiFiManagerParameter custom_lane_id("lane_id", "Lan (in/out)", lane_id, 16);
 
   wm.addParameter(&custom_server_ip);
   wm.addParameter(&custom_server_port);
   wm.addParameter(&custom_device_token);
+  wm.addParameter(&custom_gate_id);
+  wm.addParameter(&custom_lane_id);
 
   // LOGIC RESET CẤU HÌNH
   if (digitalRead(TRIGGER_PIN) == LOW) {
@@ -147,12 +184,17 @@ void setup() {
   Serial.print("IP Address: ");
   Serial.println(WiFi.localIP());
 
+  // Đồng bộ giờ (UTC) để ghi thời điểm các lượt quẹt lúc mất mạng
+  configTime(0, 0, "pool.ntp.org", "time.google.com");
+
   // 5. Lưu lại cấu hình mới nếu người dùng vừa nhập thay đổi
   if (shouldSaveConfig) {
     // Lấy giá trị từ WiFiManager
     strcpy(server_ip, custom_server_ip.getValue());
     strcpy(server_port, custom_server_port.getValue());
     strcpy(device_token, custom_device_token.getValue());
+    strcpy(gate_id, custom_gate_id.getValue());
+    strcpy(lane_id, custom_lane_id.getValue());
 
     Serial.println("Dang luu cau hinh moi vao Flash...");
     
@@ -161,6 +203,8 @@ void setup() {
     preferences.putString("server_ip", server_ip);
     preferences.putString("server_port", server_port);
     preferences.putString("device_token", device_token);
+    preferences.putString("gate_id", gate_id);
+    preferences.putString("lane_id", lane_id);
     preferences.end(); // Đóng lại ngay sau khi ghi
     // ---------------------------------------------
     
@@ -185,6 +229,12 @@ void loop() {
     }
   }
 
+  // Có mạng lại: gửi các lượt quẹt đã lưu tạm
+  if (offlineCount > 0 && currentState == STATE_IDLE && WiFi.status() == WL_CONNECTED &&
+      millis() - lastFlushAttempt > OFFLINE_FLUSH_INTERVAL_MS) {
+    flushOfflineSwipes();
+  }
+
   // State Machine xử lý thẻ
   switch (currentState) {
     case STATE_IDLE:
@@ -210,16 +260,19 @@ void handleIdleState() {
     return;
   }
 
+  String cardUid = getCardUID(mfrc522.uid);
+  Serial.printf("Quet the: %s\n", cardUid.c_str());
+
   // Kiểm tra WiFi trước khi gửi
   if (WiFi.status() != WL_CONNECTED) {
-    Serial.println("Mat WiFi! Dang thu ket noi lai...");
-    // WiFiManager tự xử lý reconnect, ta chỉ cần đợi
+    Serial.println("Mat WiFi! Luu tam luot quet, dang thu ket noi lai...");
+    // WiFiManager tự xử lý reconnect; lượt quẹt được gửi lại theo lô khi có mạng
+    bufferOfflineSwipe(cardUid);
+    lastTriggerTime = now;
+    mfrc522.PICC_HaltA();
     return; 
   }
 
-  String cardUid = getCardUID(mfrc522.uid);
-  Serial.printf("Quet the: %s\n", cardUid.c_str());
-
   HTTPClient http;
   char serverUrl[128];
   // SỬ DỤNG IP VÀ PORT TỪ BIẾN CẤU HÌNH
@@ -229,14 +282,23 @@ void handleIdleState() {
 
   http.begin(serverUrl);
   http.addHeader("Content-Type", "application/json");
+  http.addHeader("X-Device-Token", device_token);
 
-  StaticJsonDocument<200> jsonDoc;
+  StaticJsonDocument<256> jsonDoc;
   jsonDoc["card_id"] = cardUid;
-  jsonDoc["token"] = device_token;
+  jsonDoc["gate_id"] = gate_id;
+  jsonDoc["lane"] = lane_id;
+  jsonDoc["device_id"] = WiFi.macAddress();
+  jsonDoc["idempotency_key"] = WiFi.macAddress() + "-" + String(now);
   String jsonPayload;
   serializeJson(jsonDoc, jsonPayload);
 
   int httpResponseCode = http.POST(jsonPayload);
+  for (int attempt = 0; httpResponseCode <= 0 && attempt < SCAN_RETRIES; attempt++) {
+    Serial.printf("Loi HTTP POST: %s, gui lai...\n", http.errorToString(httpResponseCode).c_str());
+    delay(300);
+    httpResponseCode = http.POST(jsonPayload);
+  }
   if (httpResponseCode > 0) {
     String responsePayload = http.getString();
     Serial.printf("Server tra ve: %s\n", responsePayload.c_str());
@@ -273,18 +335,33 @@ void handlePollingState() {
     stopPolling();
     return;
   }
+#if !USE_LONG_POLL
   if (now - lastPollCheck < POLLING_INTERVAL) return;
+#endif
 
   lastPollCheck = now;
   
   if (WiFi.status() != WL_CONNECTED) return;
 
   HTTPClient httpPoll;
-  char pollUrl[128];
+  char pollUrl[256];
   // SỬ DỤNG IP VÀ PORT TỪ BIẾN CẤU HÌNH
-  sprintf(pollUrl, "http://%s:%s%s?id=%d", server_ip, server_port, API_CHECK_STATUS, currentPollId);
+#if USE_LONG_POLL
+  // Chỉ chờ phần thời gian còn lại của POLLING_TIMEOUT
+  unsigned long remainingS = (POLLING_TIMEOUT - (now - pollingStartTime)) / 1000UL;
+  int waitS = remainingS < (unsigned long)LONG_POLL_WAIT_S ? (int)remainingS : LONG_POLL_WAIT_S;
+  if (waitS < 1) waitS = 1;
+  sprintf(pollUrl, "http://%s:%s%s?id=%d&timeout=%d&device_id=%s", server_ip, server_port, API_WAIT_STATUS,
+          currentPollId, waitS, WiFi.macAddress().c_str());
+  httpPoll.setTimeout((waitS + 5) * 1000);
+#else
+  sprintf(pollUrl, "http://%s:%s%s?id=%d&device_id=%s", server_ip, server_port, API_CHECK_STATUS,
+          currentPollId, WiFi.macAddress().c_str());
+#endif
   
   httpPoll.begin(pollUrl);
+  // Token đi trong header để không lộ ra access log / proxy log như query string
+  httpPoll.addHeader("X-Device-Token", device_token);
   int httpResponseCode = httpPoll.GET();
 
   if (httpResponseCode > 0) {
@@ -321,6 +398,55 @@ void stopPolling() {
   Serial.println("Trang thai IDLE.");
 }
 
+void bufferOfflineSwipe(const String& cardUid) {
+  time_t nowTs = time(nullptr);
+  if (nowTs < 1700000000) {
+    Serial.println("Chua dong bo gio, khong the luu luot quet.");
+    return;
+  }
+  if (offlineCount >= MAX_OFFLINE_SWIPES) {
+    Serial.println("Bo dem offline da day!");
+    return;
+  }
+  cardUid.toCharArray(offlineSwipes[offlineCount].cardId, sizeof(offlineSwipes[offlineCount].cardId));
+  offlineSwipes[offlineCount].ts = nowTs;
+  offlineCount++;
+  Serial.printf("Da luu tam %d luot quet.\n", offlineCount);
+}
+
+void flushOfflineSwipes() {
+  lastFlushAttempt = millis();
+
+  HTTPClient http;
+  char serverUrl[128];
+  sprintf(serverUrl, "http://%s:%s%s", server_ip, server_port, API_DEVICE_SCAN_BATCH);
+  http.begin(serverUrl);
+  http.addHeader("Content-Type", "application/json");
+  http.addHeader("X-Device-Token", device_token);
+
+  DynamicJsonDocument jsonDoc(512 + MAX_OFFLINE_SWIPES * 96);
+  jsonDoc["device_id"] = WiFi.macAddress();
+  JsonArray swipes = jsonDoc.createNestedArray("swipes");
+  for (int i = 0; i < offlineCount; i++) {
+    JsonObject swipe = swipes.createNestedObject();
+    swipe["card_id"] = offlineSwipes[i].cardId;
+    swipe["ts"] = (long)offlineSwipes[i].ts;
+  }
+  String jsonPayload;
+  serializeJson(jsonDoc, jsonPayload);
+
+  int httpResponseCode = http.POST(jsonPayload);
+  if (httpResponseCode == 200) {
+    // Server đã xử lý từng lượt (kể cả lượt trùng/không hợp lệ): xóa bộ đệm.
+    // Gửi lại cùng lô cũng an toàn vì server nhận ra lượt đã đồng bộ.
+    Serial.printf("Da dong bo %d luot quet offline.\n", offlineCount);
+    offlineCount = 0;
+  } else {
+    Serial.printf("Dong bo offline that bai (%d), se thu lai.\n", httpResponseCode);
+  }
+  http.end();
+}
+
 String getCardUID(MFRC522::Uid uid) {
   String uidString = "";
   for (byte i = 0; i < uid.size; i++) {
@@ -3,7 +3,12 @@ import os
 from flask import Flask
 
 from config import Config
+from app.database import init_db
 from app.routes import admin_bp, api_bp, auth_bp, security_bp
+from app.services.action_queue import init_action_queue
+from app.services.camera import start_gate_cameras
+from app.services.scheduler import init_scheduler
+from app.services.snapshot_writer import init_snapshot_writer
 from app.utils import register_template_filters
 
 
@@ -12,8 +17,13 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
 
     os.makedirs(app.config["SNAPSHOT_DIR"], exist_ok=True)
+    init_db(app)
+    init_snapshot_writer(app)
+    init_action_queue(app)
+    init_scheduler(app)
     register_template_filters(app)
     _register_blueprints(app)
+    start_gate_cameras(app)
     return app
 
 
@@ -1,12 +1,205 @@
+import queue
 import sqlite3
-from flask import current_app
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
 
+from flask import Flask, current_app, g
 
-def get_db_connection() -> sqlite3.Connection:
-    """Trả về kết nối SQLite với cấu hình chung."""
-    conn = sqlite3.connect(
-        current_app.config["DATABASE_PATH"],
-        timeout=current_app.config.get("SQLITE_TIMEOUT", 20.0),
+
+# Bộ PRAGMA áp dụng khi tạo kết nối. "wal" cho phép đọc báo cáo song song với ghi ở cổng.
+STORAGE_PROFILES: Dict[str, Dict[str, object]] = {
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -16000,  # âm = KiB
+        "temp_store": "MEMORY",
+    },
+    "legacy": {},
+}
+
+
+class PooledConnection:
+    """
+    Bọc sqlite3.Connection lấy từ pool.
+    close() không đóng kết nối thật mà trả nó về pool để request sau dùng lại.
+    """
+
+    __slots__ = ("_conn", "_pool")
+
+    def __init__(self, conn: sqlite3.Connection, pool: "ConnectionPool"):
+        self._conn = conn
+        self._pool = pool
+
+    @property
+    def raw(self) -> sqlite3.Connection:
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._pool.release(conn)
+        if g and g.get("db_conn") is self:
+            g.pop("db_conn", None)
+
+    @property
+    def closed(self) -> bool:
+        return self._conn is None
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return getattr(self._conn, name)
+
+
+class ConnectionPool:
+    """Pool kết nối SQLite có giới hạn số lượng, PRAGMA chỉ chạy một lần khi tạo kết nối."""
+
+    def __init__(
+        self,
+        database_path: str,
+        size: int = 8,
+        timeout: float = 20.0,
+        acquire_timeout: float = 10.0,
+        pragmas: Optional[Dict[str, object]] = None,
+    ):
+        self.database_path = database_path
+        self.pragmas = dict(pragmas or {})
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=self.size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.database_path, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        configure_connection(conn, self.pragmas)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._create()
+                except Exception:
+                    self._created -= 1
+                    raise
+
+        try:
+            return self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise TimeoutError(f"Hết kết nối trong pool SQLite (size={self.size}).") from None
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except Exception:
+            # Kết nối hỏng hoặc pool đầy: bỏ hẳn để lần sau tạo mới.
+            self._discard(conn)
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+def configure_connection(conn: sqlite3.Connection, pragmas: Dict[str, object]) -> None:
+    """Thiết lập PRAGMA cho kết nối mới (chạy một lần cho mỗi kết nối trong pool)."""
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+def build_pragmas(config) -> Dict[str, object]:
+    """Ghép PRAGMA từ storage profile và các giá trị ghi đè trong config."""
+    profile_name = config.get("SQLITE_STORAGE_PROFILE", "wal")
+    if profile_name not in STORAGE_PROFILES:
+        raise ValueError(f"SQLITE_STORAGE_PROFILE không hợp lệ: {profile_name}")
+    pragmas = dict(STORAGE_PROFILES[profile_name])
+    for key, pragma in (
+        ("SQLITE_SYNCHRONOUS", "synchronous"),
+        ("SQLITE_MMAP_SIZE", "mmap_size"),
+        ("SQLITE_CACHE_SIZE", "cache_size"),
+        ("SQLITE_TEMP_STORE", "temp_store"),
+    ):
+        if config.get(key) is not None:
+            pragmas[pragma] = config[key]
+    pragmas.update(config.get("SQLITE_PRAGMAS") or {})
+    return pragmas
+
+
+def checkpoint_wal(conn, mode: str = "PASSIVE"):
+    """Chạy wal_checkpoint; trả về (busy, log_frames, checkpointed_frames)."""
+    row = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    return tuple(row) if row else None
+
+
+def init_db(app: Flask) -> ConnectionPool:
+    """Tạo pool kết nối cho app và đăng ký teardown trả kết nối về pool."""
+    pool = ConnectionPool(
+        app.config["DATABASE_PATH"],
+        size=app.config.get("SQLITE_POOL_SIZE", 8),
+        timeout=app.config.get("SQLITE_TIMEOUT", 20.0),
+        acquire_timeout=app.config.get("SQLITE_POOL_TIMEOUT", 10.0),
+        pragmas=build_pragmas(app.config),
     )
-    conn.row_factory = sqlite3.Row
+    app.extensions["sqlite_pool"] = pool
+    app.teardown_appcontext(_release_request_connection)
+    return pool
+
+
+def get_pool(app: Optional[Flask] = None) -> ConnectionPool:
+    app = app or current_app
+    return app.extensions["sqlite_pool"]
+
+
+def _release_request_connection(exc=None) -> None:
+    conn = g.pop("db_conn", None)
+    if conn is not None:
+        conn.close()
+
+
+def get_db_connection() -> PooledConnection:
+    """
+    Trả về kết nối SQLite gắn với request hiện tại (flask.g).
+    Gọi nhiều lần trong cùng request sẽ dùng lại một kết nối; teardown trả về pool.
+    """
+    conn = g.get("db_conn")
+    if conn is None or conn.closed:
+        pool = get_pool()
+        conn = PooledConnection(pool.acquire(), pool)
+        g.db_conn = conn
     return conn
+
+
+@contextmanager
+def pooled_connection(app: Optional[Flask] = None) -> Iterator[PooledConnection]:
+    """Mượn kết nối từ pool ngoài request (luồng nền, CLI)."""
+    pool = get_pool(app)
+    conn = PooledConnection(pool.acquire(), pool)
+    try:
+        yield conn
+    finally:
+        conn.close()
@@ -2,22 +2,47 @@ import json
 import sqlite3
 from datetime import datetime, timedelta
 
-from flask import Blueprint, flash, redirect, render_template, request, session, url_for
+from flask import Blueprint, flash, jsonify, redirect, render_template, request, session, url_for
 from werkzeug.security import generate_password_hash
 
 from app.database import get_db_connection
+from app.services.action_queue import get_action_queue
+from app.services.card_registry import get_card_registry
+from app.services.count_cache import get_count_cache
+from app.services.device_admission import get_device_admission
+from app.services.rollups import record_monthly_payment
+from app.services.scheduler import get_scheduler
+from app.services.stats_cache import get_stats_cache
+from app.services.settings import get_settings_service
+from app.services.snapshot_writer import get_snapshot_writer
 from app.utils import (
     add_months,
+    decode_cursor,
+    encode_cursor,
     escape_like,
+    fts_phrase,
     generate_next_employee_code,
     login_required,
     parse_int_param,
     role_required,
+    to_epoch,
 )
 
 admin_bp = Blueprint("admin", __name__)
 
 
+# Khóa sắp xếp danh sách thẻ như bản gốc: created_sort (= IFNULL(created_at, ''), NULL xếp cuối) DESC, card_id ASC.
+# Hai khóa ngược chiều nên cursor không viết được thành một so sánh row-value: điều kiện trên created_sort
+# seek thẳng vào index idx_cards_created_desc, phần card_id chỉ lọc các thẻ trùng created_sort với cursor.
+CARD_PAGE_CONDITIONS = {
+    "next": "created_sort <= ? AND (created_sort < ? OR card_id > ?)",
+    "prev": "created_sort >= ? AND (created_sort > ? OR card_id < ?)",
+}
+CARD_PAGE_ORDER = {"next": "created_sort DESC, card_id ASC", "prev": "created_sort ASC, card_id DESC"}
+# Mốc "bây giờ" cùng quy ước với cột expiry_ts và view cards_display.
+EXPIRY_NOW_TS = "CAST(strftime('%s', 'now', 'localtime') AS INTEGER)"
+
+
 @admin_bp.route("/admin/dashboard")
 @login_required
 @role_required("admin")
@@ -25,83 +50,79 @@ def admin_dashboard():
     q = (request.args.get("q") or "").strip()
     ticket_type = (request.args.get("ticket_type") or "").strip()
     status_filter = (request.args.get("status") or "").strip()
-    page = parse_int_param(request.args.get("page", 1), 1)
     per_page = parse_int_param(request.args.get("per_page", 25), 25, 100)
-    offset = (page - 1) * per_page
+    cursor = decode_cursor(request.args.get("cursor"))
 
     conn = get_db_connection()
+    source = "cards_display"
     conditions = []
     params = []
-    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     if q:
-        like_term = f"%{escape_like(q)}%"
-        conditions.append(
-            "(card_id LIKE ? ESCAPE '\\' OR IFNULL(holder_name,'') LIKE ? ESCAPE '\\' OR IFNULL(license_plate,'') LIKE ? ESCAPE '\\')"
-        )
-        params.extend([like_term, like_term, like_term])
+        # Tìm qua chỉ mục FTS5 trigram; chuỗi < 3 ký tự mới phải quét bằng LIKE.
+        phrase = fts_phrase(q)
+        if phrase:
+            # CROSS JOIN giữ FTS làm vòng ngoài: planner không được đi theo index sắp xếp rồi lọc từng thẻ qua FTS
+            # (chậm khi ít kết quả), chỉ sắp xếp tập thẻ khớp.
+            source = (
+                "(SELECT rowid AS match_rowid FROM cards_fts WHERE cards_fts MATCH ?) "
+                "CROSS JOIN cards_display ON card_rowid = match_rowid"
+            )
+            params.append(phrase)
+        else:
+            like_term = f"%{escape_like(q)}%"
+            conditions.append(
+                "(card_id LIKE ? ESCAPE '\\' OR IFNULL(holder_name,'') LIKE ? ESCAPE '\\' OR IFNULL(license_plate,'') LIKE ? ESCAPE '\\')"
+            )
+            params.extend([like_term, like_term, like_term])
 
     if ticket_type in ("monthly", "daily"):
         conditions.append("ticket_type = ?")
         params.append(ticket_type)
 
-    if status_filter == "expired":
-        conditions.append("ticket_type = 'monthly' AND expiry_date IS NOT NULL AND expiry_date < ?")
-        params.append(now_str)
-    elif status_filter in ("active", "lost"):
-        conditions.append("status = ?")
+    # display_status được tính trong view cards_display, dùng chung cho bộ lọc và cột trạng thái.
+    if status_filter in ("active", "lost", "expired"):
+        conditions.append("display_status = ?")
         params.append(status_filter)
+        if status_filter == "expired":
+            # Lặp lại điều kiện "hết hạn" trên cột gốc để seek idx_cards_type_expiry thay vì quét cả bảng.
+            conditions.append(f"ticket_type = 'monthly' AND expiry_ts < {EXPIRY_NOW_TS}")
 
     where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    total_cards = get_count_cache().count(conn, f"SELECT COUNT(*) FROM {source} {where_clause}", tuple(params))
+
+    # Phân trang keyset: chỉ đọc đúng per_page + 1 dòng sau/trước cursor, không dùng OFFSET.
+    page_conditions = list(conditions)
+    page_params = list(params)
+    direction = "next"
+    if cursor and len(cursor[1]) == 2 and all(isinstance(value, str) for value in cursor[1]):
+        direction, (sort_value, last_card_id) = cursor
+        page_conditions.append(CARD_PAGE_CONDITIONS[direction])
+        page_params.extend([sort_value, sort_value, last_card_id])
+    else:
+        cursor = None
 
-    total_cards = conn.execute(f"SELECT COUNT(*) FROM cards {where_clause}", params).fetchone()[0]
+    page_where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
     rows = conn.execute(
-        f"""SELECT card_id, holder_name, license_plate, ticket_type, status, created_at, expiry_date
-            FROM cards
-            {where_clause}
-            ORDER BY created_at DESC, card_id
-            LIMIT ? OFFSET ?""",
-        params + [per_page, offset],
+        f"""SELECT card_id, holder_name, license_plate, ticket_type, status, created_at, created_sort, expiry_ts, display_status
+            FROM {source}
+            {page_where}
+            ORDER BY {CARD_PAGE_ORDER[direction]}
+            LIMIT ?""",
+        page_params + [per_page + 1],
     ).fetchall()
     conn.close()
 
-    cards = []
-    now_dt = datetime.now()
-    for row in rows:
-        card = dict(row)
-        is_expired = False
-        if card.get("expiry_date"):
-            try:
-                is_expired = datetime.strptime(card["expiry_date"], "%Y-%m-%d %H:%M:%S") < now_dt
-            except ValueError:
-                is_expired = False
-        display_status = card.get("status") or "unknown"
-        if display_status != "lost" and card.get("ticket_type") == "monthly" and is_expired:
-            display_status = "expired"
-        card["display_status"] = display_status
-        cards.append(card)
-
-    has_next = offset + per_page < total_cards
-    prev_url = (
-        url_for(
-            "admin.admin_dashboard",
-            **{
-                k: v
-                for k, v in {
-                    "q": q or None,
-                    "ticket_type": ticket_type or None,
-                    "status": status_filter or None,
-                    "per_page": per_page,
-                    "page": page - 1,
-                }.items()
-                if v is not None
-            },
-        )
-        if page > 1
-        else None
-    )
-    next_url = (
-        url_for(
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == "prev":
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+
+    def page_url(cursor_direction, row):
+        return url_for(
             "admin.admin_dashboard",
             **{
                 k: v
@@ -110,19 +131,18 @@ def admin_dashboard():
                     "ticket_type": ticket_type or None,
                     "status": status_filter or None,
                     "per_page": per_page,
-                    "page": page + 1,
+                    "cursor": encode_cursor(cursor_direction, [row["created_sort"], row["card_id"]]),
                 }.items()
                 if v is not None
             },
         )
-        if has_next
-        else None
-    )
+
+    prev_url = page_url("prev", rows[0]) if has_prev and rows else None
+    next_url = page_url("next", rows[-1]) if has_next and rows else None
 
     return render_template(
         "admin_dashboard.html",
-        cards=cards,
-        page=page,
+        cards=rows,
         per_page=per_page,
         total_cards=total_cards,
         filters={
@@ -362,6 +382,7 @@ def add_card():
                 "active",
             ),
         )
+        get_card_registry().invalidate(conn, card_id)
         conn.commit()
         flash(f"Đã thêm thẻ {card_id} thành công!", "success")
     except sqlite3.IntegrityError:
@@ -407,9 +428,7 @@ def edit_card():
             new_expiry_dt = add_months(base_date, extend_months)
             new_expiry_date = new_expiry_dt.strftime("%Y-%m-%d %H:%M:%S")
 
-            settings_data = conn.execute("SELECT * FROM settings").fetchall()
-            settings = {row["key"]: row["value"] for row in settings_data}
-            monthly_fee = int(settings.get("monthly_fee", 0))
+            monthly_fee = get_settings_service().monthly_fee(conn)
             total_amount = monthly_fee * extend_months
             paid_at = datetime.now()
             month_label = paid_at.strftime("%Y-%m")
@@ -417,6 +436,7 @@ def edit_card():
                 "INSERT INTO monthly_payments (card_id, month, amount, paid_at) VALUES (?, ?, ?, ?)",
                 (new_card_id, month_label, total_amount, paid_at.strftime("%Y-%m-%d %H:%M:%S")),
             )
+            record_monthly_payment(conn, month_label, total_amount)
 
         conn.execute(
             """UPDATE cards 
@@ -424,6 +444,7 @@ def edit_card():
                WHERE card_id = ?""",
             (new_card_id, holder_name, license_plate if ticket_type == "monthly" else None, new_expiry_date, original_card_id),
         )
+        get_card_registry().invalidate(conn, original_card_id, new_card_id)
         conn.commit()
         flash(f"Đã cập nhật thẻ {new_card_id} thành công!", "success")
     except sqlite3.IntegrityError:
@@ -456,6 +477,7 @@ def set_card_status():
             return redirect(url_for("admin.admin_dashboard"))
 
         conn.execute("UPDATE cards SET status = ? WHERE card_id = ?", (new_status, card_id))
+        get_card_registry().invalidate(conn, card_id)
         conn.commit()
         msg = "Đã kích hoạt lại thẻ." if new_status == "active" else "Đã báo mất thẻ, thẻ bị vô hiệu hóa."
         flash(msg, "success")
@@ -474,6 +496,7 @@ def set_card_status():
 def delete_card(card_id):
     conn = get_db_connection()
     conn.execute("DELETE FROM cards WHERE card_id = ?", (card_id,))
+    get_card_registry().invalidate(conn, card_id)
     conn.commit()
     conn.close()
     flash(f"Đã xóa thẻ {card_id} thành công!", "success")
@@ -489,20 +512,24 @@ def view_transactions():
     guard_filter = (request.args.get("guard") or "").strip()
     date_from = (request.args.get("from") or "").strip()
     date_to = (request.args.get("to") or "").strip()
-    page = parse_int_param(request.args.get("page", 1), 1)
     per_page = parse_int_param(request.args.get("per_page", 25), 25, 200)
-    offset = (page - 1) * per_page
+    cursor = decode_cursor(request.args.get("cursor"))
 
     conn = get_db_connection()
     conditions = []
     params = []
 
     if q:
-        like_term = f"%{escape_like(q)}%"
-        conditions.append(
-            "(card_id LIKE ? ESCAPE '\\' OR IFNULL(license_plate,'') LIKE ? ESCAPE '\\' OR IFNULL(security_user,'') LIKE ? ESCAPE '\\')"
-        )
-        params.extend([like_term, like_term, like_term])
+        phrase = fts_phrase(q)
+        if phrase:
+            conditions.append("id IN (SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH ?)")
+            params.append(phrase)
+        else:
+            like_term = f"%{escape_like(q)}%"
+            conditions.append(
+                "(card_id LIKE ? ESCAPE '\\' OR IFNULL(license_plate,'') LIKE ? ESCAPE '\\' OR IFNULL(security_user,'') LIKE ? ESCAPE '\\')"
+            )
+            params.extend([like_term, like_term, like_term])
 
     if status_filter == "open":
         conditions.append("exit_time IS NULL")
@@ -510,52 +537,65 @@ def view_transactions():
         conditions.append("exit_time IS NOT NULL")
 
     if guard_filter:
-        like_guard = f"%{escape_like(guard_filter)}%"
-        conditions.append("IFNULL(security_user,'') LIKE ? ESCAPE '\\'")
-        params.append(like_guard)
+        guard_phrase = fts_phrase(guard_filter, column="security_user")
+        if guard_phrase:
+            conditions.append("id IN (SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH ?)")
+            params.append(guard_phrase)
+        else:
+            like_guard = f"%{escape_like(guard_filter)}%"
+            conditions.append("IFNULL(security_user,'') LIKE ? ESCAPE '\\'")
+            params.append(like_guard)
 
+    # Lọc theo cột giây epoch exit_ts (có index); NULL (xe chưa ra) tự bị loại.
     if date_from:
-        conditions.append("exit_time IS NOT NULL AND exit_time >= ?")
-        params.append(f"{date_from} 00:00:00")
+        try:
+            params.append(to_epoch(datetime.strptime(date_from, "%Y-%m-%d")))
+            conditions.append("exit_ts >= ?")
+        except ValueError:
+            pass
     if date_to:
-        conditions.append("exit_time IS NOT NULL AND exit_time <= ?")
-        params.append(f"{date_to} 23:59:59")
+        try:
+            params.append(to_epoch(datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)))
+            conditions.append("exit_ts < ?")
+        except ValueError:
+            pass
 
     where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    total_transactions = get_count_cache().count(
+        conn, f"SELECT COUNT(*) FROM transactions {where_clause}", tuple(params)
+    )
+
+    # Phân trang keyset theo id DESC.
+    page_conditions = list(conditions)
+    page_params = list(params)
+    direction = "next"
+    if cursor and len(cursor[1]) == 1 and isinstance(cursor[1][0], int):
+        direction, (last_id,) = cursor
+        page_conditions.append("id < ?" if direction == "next" else "id > ?")
+        page_params.append(last_id)
+    else:
+        cursor = None
 
-    total_transactions = conn.execute(f"SELECT COUNT(*) FROM transactions {where_clause}", params).fetchone()[0]
+    page_where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
     rows = conn.execute(
         f"""SELECT * FROM transactions
-            {where_clause}
-            ORDER BY id DESC
-            LIMIT ? OFFSET ?""",
-        params + [per_page, offset],
+            {page_where}
+            ORDER BY id {"DESC" if direction == "next" else "ASC"}
+            LIMIT ?""",
+        page_params + [per_page + 1],
     ).fetchall()
     conn.close()
 
-    has_next = offset + per_page < total_transactions
-    prev_url = (
-        url_for(
-            "admin.view_transactions",
-            **{
-                k: v
-                for k, v in {
-                    "q": q or None,
-                    "status": status_filter or None,
-                    "guard": guard_filter or None,
-                    "from": date_from or None,
-                    "to": date_to or None,
-                    "per_page": per_page,
-                    "page": page - 1,
-                }.items()
-                if v is not None
-            },
-        )
-        if page > 1
-        else None
-    )
-    next_url = (
-        url_for(
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == "prev":
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+
+    def page_url(cursor_direction, row):
+        return url_for(
             "admin.view_transactions",
             **{
                 k: v
@@ -566,19 +606,18 @@ def view_transactions():
                     "from": date_from or None,
                     "to": date_to or None,
                     "per_page": per_page,
-                    "page": page + 1,
+                    "cursor": encode_cursor(cursor_direction, [row["id"]]),
                 }.items()
                 if v is not None
             },
         )
-        if has_next
-        else None
-    )
+
+    prev_url = page_url("prev", rows[0]) if has_prev and rows else None
+    next_url = page_url("next", rows[-1]) if has_next and rows else None
 
     return render_template(
         "transactions.html",
         transactions=rows,
-        page=page,
         per_page=per_page,
         total_transactions=total_transactions,
         filters={
@@ -597,18 +636,26 @@ def view_transactions():
 @login_required
 @role_required("admin")
 def settings():
+    service = get_settings_service()
     conn = get_db_connection()
     if request.method == "POST":
-        fee_per_hour = request.form["fee_per_hour"]
-        monthly_fee = request.form["monthly_fee"]
-        conn.execute("UPDATE settings SET value = ? WHERE key = ?", (fee_per_hour, "fee_per_hour"))
-        conn.execute("UPDATE settings SET value = ? WHERE key = ?", (monthly_fee, "monthly_fee"))
-        conn.commit()
-        flash("Đã cập nhật cài đặt thành công!", "success")
+        try:
+            service.update(
+                conn,
+                {
+                    "fee_per_hour": request.form["fee_per_hour"],
+                    "monthly_fee": request.form["monthly_fee"],
+                },
+            )
+            conn.commit()
+            service.invalidate()
+            flash("Đã cập nhật cài đặt thành công!", "success")
+        except ValueError:
+            conn.rollback()
+            flash("Giá trị cài đặt phải là số nguyên.", "danger")
 
-    settings_data = conn.execute("SELECT * FROM settings").fetchall()
+    settings_dict = service.all(conn)
     conn.close()
-    settings_dict = {row["key"]: row["value"] for row in settings_data}
     return render_template("settings.html", settings=settings_dict)
 
 
@@ -618,18 +665,33 @@ def settings():
 def statistics():
     conn = get_db_connection()
 
-    today_str = datetime.now().strftime("%Y-%m-%d")
-
-    revenue_today = (
-        conn.execute("SELECT SUM(fee) FROM transactions WHERE date(exit_time) = ? AND fee IS NOT NULL", (today_str,)).fetchone()[0]
-        or 0
-    )
-
-    traffic_today = (
-        conn.execute("SELECT COUNT(*) FROM transactions WHERE date(entry_time) = ?", (today_str,)).fetchone()[0] or 0
-    )
-
-    cars_in_parking = conn.execute("SELECT COUNT(*) FROM transactions WHERE exit_time IS NULL").fetchone()[0] or 0
+    # Số liệu đọc từ bảng tổng hợp (daily_stats/monthly_payment_stats), không quét transactions,
+    # và được cache: ngày/tháng đã qua giữ tới khi backfill, số liệu hôm nay theo stats_version.
+    cache = get_stats_cache()
+    epoch, version = cache.versions(conn)
+    now = datetime.now()
+    today_key = now.strftime("%Y-%m-%d")
+    this_month_key = now.strftime("%Y-%m")
+
+    def load_live():
+        today = conn.execute("SELECT revenue, entries FROM daily_stats WHERE day = ?", (today_key,)).fetchone()
+        month = conn.execute(
+            "SELECT revenue, payments FROM monthly_payment_stats WHERE month = ?", (this_month_key,)
+        ).fetchone()
+        return {
+            "revenue_today": today["revenue"] if today else 0,
+            "traffic_today": today["entries"] if today else 0,
+            # Partial index chỉ chứa xe đang trong bãi nên truy vấn này không lớn dần theo lịch sử.
+            "cars_in_parking": conn.execute("SELECT COUNT(*) FROM transactions WHERE exit_time IS NULL").fetchone()[0]
+            or 0,
+            "month_revenue": month["revenue"] if month else 0,
+            "month_payments": month["payments"] if month else 0,
+        }
+
+    live = cache.get(("live", epoch, version, today_key), load_live)
+    revenue_today = live["revenue_today"]
+    traffic_today = live["traffic_today"]
+    cars_in_parking = live["cars_in_parking"]
 
     active_tab = request.args.get("active_tab", "walkin")
 
@@ -659,41 +721,33 @@ def statistics():
         day = start_date + timedelta(days=i)
         date_labels.append(day.strftime("%Y-%m-%d"))
 
-    s_str = start_date.strftime("%Y-%m-%d 00:00:00")
-    e_str = end_date.strftime("%Y-%m-%d 23:59:59")
-
-    rev_data = conn.execute(
-        """
-        SELECT date(exit_time) as day, SUM(fee) as total 
-        FROM transactions 
-        WHERE exit_time BETWEEN ? AND ? AND fee IS NOT NULL
-        GROUP BY date(exit_time)
-    """,
-        (s_str, e_str),
-    ).fetchall()
+    start_key = start_date.strftime("%Y-%m-%d")
+    end_key = end_date.strftime("%Y-%m-%d")
+    past_end_key = min(end_key, (now - timedelta(days=1)).strftime("%Y-%m-%d"))
 
-    traf_data = conn.execute(
-        """
-        SELECT date(entry_time) as day, COUNT(*) as total 
-        FROM transactions 
-        WHERE entry_time BETWEEN ? AND ?
-        GROUP BY date(entry_time)
-    """,
-        (s_str, e_str),
-    ).fetchall()
+    def load_days(first_key, last_key):
+        rows = conn.execute(
+            "SELECT day, revenue, entries FROM daily_stats WHERE day BETWEEN ? AND ?", (first_key, last_key)
+        ).fetchall()
+        return {row["day"]: (row["revenue"], row["entries"]) for row in rows}
 
-    conn.close()
+    daily_totals = {}
+    if start_key <= past_end_key:
+        daily_totals.update(
+            cache.get(("daily", epoch, start_key, past_end_key), lambda: load_days(start_key, past_end_key))
+        )
+    if start_key <= today_key <= end_key:
+        daily_totals[today_key] = (revenue_today, traffic_today)
 
-    rev_dict = {row["day"]: row["total"] for row in rev_data}
-    traf_dict = {row["day"]: row["total"] for row in traf_data}
+    rev_dict = {day: totals[0] for day, totals in daily_totals.items()}
+    traf_dict = {day: totals[1] for day, totals in daily_totals.items()}
 
     final_dates = []
     final_revenues = []
     final_traffics = []
 
     for d_str in date_labels:
-        d_obj = datetime.strptime(d_str, "%Y-%m-%d")
-        final_dates.append(d_obj.strftime("%d/%m"))
+        final_dates.append(f"{d_str[8:10]}/{d_str[5:7]}")
 
         final_revenues.append(rev_dict.get(d_str, 0))
         final_traffics.append(traf_dict.get(d_str, 0))
@@ -739,32 +793,24 @@ def statistics():
         m_start_key = month_end.strftime("%Y-%m")
         m_end_key = month_end.strftime("%Y-%m")
 
-    conn_month = get_db_connection()
-    monthly_rev_data = conn_month.execute(
-        """
-        SELECT month, SUM(amount) as total
-        FROM monthly_payments
-        WHERE month BETWEEN ? AND ?
-        GROUP BY month
-        ORDER BY month
-    """,
-        (m_start_key, m_end_key),
-    ).fetchall()
+    past_month_end_key = min(m_end_key, shift_month(now, -1).strftime("%Y-%m"))
 
-    monthly_count_data = conn_month.execute(
-        """
-        SELECT month, COUNT(*) as total
-        FROM monthly_payments
-        WHERE month BETWEEN ? AND ?
-        GROUP BY month
-        ORDER BY month
-    """,
-        (m_start_key, m_end_key),
-    ).fetchall()
-    conn_month.close()
+    def load_months():
+        rows = conn.execute(
+            "SELECT month, revenue, payments FROM monthly_payment_stats WHERE month BETWEEN ? AND ?",
+            (m_start_key, past_month_end_key),
+        ).fetchall()
+        return {row["month"]: (row["revenue"], row["payments"]) for row in rows}
 
-    monthly_rev_dict = {row["month"]: row["total"] for row in monthly_rev_data}
-    monthly_count_dict = {row["month"]: row["total"] for row in monthly_count_data}
+    monthly_totals = {}
+    if m_start_key <= past_month_end_key:
+        monthly_totals.update(cache.get(("monthly", epoch, m_start_key, past_month_end_key), load_months))
+    if m_start_key <= this_month_key <= m_end_key:
+        monthly_totals[this_month_key] = (live["month_revenue"], live["month_payments"])
+    conn.close()
+
+    monthly_rev_dict = {month: totals[0] for month, totals in monthly_totals.items()}
+    monthly_count_dict = {month: totals[1] for month, totals in monthly_totals.items()}
 
     monthly_revenues = [monthly_rev_dict.get(key, 0) for key in month_keys]
     monthly_counts = [monthly_count_dict.get(key, 0) for key in month_keys]
@@ -792,3 +838,19 @@ def statistics():
         monthly_payment_count=monthly_payment_count,
         active_tab=active_tab,
     )
+
+
+@admin_bp.route("/admin/metrics")
+@login_required
+@role_required("admin")
+def metrics():
+    """Số liệu vận hành của các dịch vụ nền (JSON) để giám sát."""
+    return jsonify(
+        {
+            "snapshot_writer": get_snapshot_writer().stats(),
+            "action_queue": get_action_queue().stats(),
+            "device_admission": get_device_admission().stats(),
+            "scheduler": get_scheduler().stats(),
+            "stats_cache": get_stats_cache().stats(),
+        }
+    )
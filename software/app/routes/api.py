@@ -1,63 +1,99 @@
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 
 from flask import Blueprint, Response, current_app, jsonify, request
 
 from app.database import get_db_connection
+from app.services.action_queue import FINAL_ACTION_STATUSES, get_action_queue
 from app.services.camera import generate_frames
-from app.utils import login_required
+from app.services.card_registry import get_card_registry
+from app.services.device_admission import get_device_admission
+from app.services.offline_swipes import ingest_swipes
+from app.services.settings import get_settings_service
+from app.utils import login_required, to_epoch
 
 api_bp = Blueprint("api", __name__)
 
 
+def _admit_device(kind: str, values, body: dict, require_token: bool = True):
+    """
+    Xác thực + giới hạn tần suất thiết bị trước khi xử lý (không chạm DB).
+    Trả về (mã thiết bị, None) nếu được nhận, hoặc (None, response lỗi 429/403).
+    Token đọc từ header X-Device-Token; "token" trong body/query chỉ còn cho firmware cũ.
+    """
+    token = request.headers.get("X-Device-Token") or values.get("token")
+    device, error, retry_after = get_device_admission().admit(
+        kind, values.get("device_id"), token, request.remote_addr, require_token
+    )
+    if error is None:
+        return device, None
+    if error == "rate_limited":
+        response = jsonify(dict(body, message="Too many requests"))
+        response.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+        return None, (response, 429)
+    return None, (jsonify(dict(body, message="Unauthorized")), 403)
+
+
 @api_bp.route("/api/gate/device_scan", methods=["POST"])
 def device_scan():
     """
     API xử lý quẹt thẻ từ ESP32.
     """
     conn = None
+    reservation = None
     try:
         data = request.get_json()
         if not data:
             return jsonify({"action": "wait", "message": "Bad request"}), 400
 
-        if data.get("token") != current_app.config["DEVICE_SECRET_TOKEN"]:
-            return jsonify({"action": "wait", "message": "Unauthorized"}), 403
+        device, rejection = _admit_device("scan", data, {"action": "wait"})
+        if rejection:
+            return rejection
 
         card_id = data.get("card_id")
         if not card_id:
             return jsonify({"action": "wait", "message": "Missing card_id"}), 400
 
+        # Cổng/làn nơi quẹt thẻ (firmware cũ không gửi: xếp vào cổng mặc định).
+        origin = {key: str(data[key]).strip() or None if data.get(key) else None for key in ("gate_id", "lane")}
+
+        # Chống quẹt lặp (thẻ để trên đầu đọc, firmware gửi lại khi lỗi mạng): trả lại phản hồi cũ, không ghi thêm.
+        queue = get_action_queue()
+        idempotency_key = str(data["idempotency_key"]) if data.get("idempotency_key") else None
+        previous = queue.recall_scan(device, card_id, idempotency_key)
+        if previous is not None:
+            return jsonify(dict(previous, duplicate=True))
+        reservation = (device, card_id, idempotency_key)
+        # Khi chạy nhiều worker, bản lặp tới worker khác bị chặn bởi cột UNIQUE pending_actions.idempotency_key.
+        origin["idempotency_key"] = f"{device}:{idempotency_key}" if idempotency_key else None
+
+        def reply(response, poll_id=None):
+            queue.remember_scan(device, card_id, idempotency_key, response, poll_id)
+            return jsonify(response)
+
         conn = get_db_connection()
 
-        # Kiểm tra thẻ tồn tại
-        card_info = conn.execute("SELECT * FROM cards WHERE card_id = ?", (card_id,)).fetchone()
+        # Kiểm tra thẻ tồn tại (qua cache thẻ trong tiến trình)
+        card_info = get_card_registry().get(conn, card_id)
 
         if not card_info:
             try:
-                conn.execute(
-                    "INSERT INTO pending_actions (card_id, status, action_type, created_at) VALUES (?, ?, ?, ?)",
-                    (card_id, "alert_unregistered", "alert", datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
-                )
-                conn.commit()
+                queue.submit(conn, card_id, "alert_unregistered", "alert", **origin)
             except Exception as exc:
                 current_app.logger.warning("Lỗi ghi alert thẻ lạ: %s", exc)
 
             conn.close()
-            return jsonify({"action": "wait", "message": "Thẻ không thuộc bãi xe"})
+            return reply({"action": "wait", "message": "Thẻ không thuộc bãi xe"})
 
-        if card_info["status"] == "lost":
+        if card_info.status == "lost":
             try:
-                conn.execute(
-                    "INSERT INTO pending_actions (card_id, status, action_type, created_at) VALUES (?, ?, ?, ?)",
-                    (card_id, "alert_lost", "alert", datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
-                )
-                conn.commit()
+                queue.submit(conn, card_id, "alert_lost", "alert", **origin)
             except Exception as exc:
                 current_app.logger.warning("Lỗi ghi alert lost-card: %s", exc)
 
             conn.close()
-            return jsonify({"action": "wait", "message": "Thẻ này đã bị báo mất. Vui lòng liên hệ quản lý."})
+            return reply({"action": "wait", "message": "Thẻ này đã bị báo mất. Vui lòng liên hệ quản lý."})
 
         active_transaction = conn.execute(
             "SELECT * FROM transactions WHERE card_id = ? AND exit_time IS NULL", (card_id,)
@@ -66,88 +102,135 @@ def device_scan():
         # === CASE 1: XE RA ===
         if active_transaction:
             exit_time_dt = datetime.now()
-            card_type = card_info["ticket_type"]
-
-            entry_time_dt = datetime.strptime(active_transaction["entry_time"], "%Y-%m-%d %H:%M:%S")
-            duration = exit_time_dt - entry_time_dt
-
-            fee = 0
-            expiry_date_dt = None
-            if card_info["expiry_date"]:
-                try:
-                    expiry_date_dt = datetime.strptime(card_info["expiry_date"], "%Y-%m-%d %H:%M:%S")
-                except ValueError:
-                    expiry_date_dt = None
-
-            should_charge_walkin = card_type == "daily" or (card_type == "monthly" and expiry_date_dt and expiry_date_dt < entry_time_dt)
-
-            if should_charge_walkin:
-                settings_data = conn.execute("SELECT * FROM settings").fetchall()
-                settings = {row["key"]: row["value"] for row in settings_data}
-                fee_per_hour = int(settings.get("fee_per_hour", 5000))
-
-                hours = max(1, -(-duration.total_seconds() // 3600))
-                fee = int(hours * fee_per_hour)
-
-            pending = conn.execute(
-                """INSERT INTO pending_actions 
-                   (card_id, status, action_type, created_at, transaction_id, license_plate, entry_time, duration, fee) 
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (
-                    card_id,
-                    "pending",
-                    "exit",
-                    exit_time_dt.strftime("%Y-%m-%d %H:%M:%S"),
-                    active_transaction["id"],
-                    active_transaction["license_plate"],
-                    active_transaction["entry_time"],
-                    str(duration).split(".")[0],
-                    fee,
-                ),
+
+            # Tính trên cột giây epoch, không parse chuỗi thời gian.
+            entry_ts = active_transaction["entry_ts"]
+            exit_ts = to_epoch(exit_time_dt)
+            duration = timedelta(seconds=max(0, exit_ts - entry_ts))
+            fee = get_settings_service().parking_fee(card_info, entry_ts, exit_ts, conn)
+
+            poll_id = queue.submit(
+                conn,
+                card_id,
+                "pending",
+                "exit",
+                **origin,
+                created_at=exit_time_dt.strftime("%Y-%m-%d %H:%M:%S"),
+                transaction_id=active_transaction["id"],
+                license_plate=active_transaction["license_plate"],
+                entry_time=active_transaction["entry_time"],
+                duration=str(duration),
+                fee=fee,
             )
-            conn.commit()
-            poll_id = pending.lastrowid
             conn.close()
-            return jsonify({"action": "poll", "poll_id": poll_id, "message": "Xe ra, chờ bảo vệ..."})
+            return reply({"action": "poll", "poll_id": poll_id, "message": "Xe ra, chờ bảo vệ..."}, poll_id)
 
         # === CASE 2: XE VÀO ===
-        pending = conn.execute(
-            "INSERT INTO pending_actions (card_id, status, action_type, created_at) VALUES (?, ?, ?, ?)",
-            (card_id, "pending", "entry", datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
-        )
-        conn.commit()
-        poll_id = pending.lastrowid
+        poll_id = queue.submit(conn, card_id, "pending", "entry", **origin)
         conn.close()
-        return jsonify({"action": "poll", "poll_id": poll_id, "message": "Chờ bảo vệ duyệt..."})
+        return reply({"action": "poll", "poll_id": poll_id, "message": "Chờ bảo vệ duyệt..."}, poll_id)
 
     except Exception as exc:
         if conn:
             conn.close()
+        if reservation:
+            get_action_queue().release_scan(*reservation)
         current_app.logger.error("Lỗi tại /api/gate/device_scan: %s", exc)
         return jsonify({"action": "wait", "message": "Lỗi server"}), 500
 
 
+@api_bp.route("/api/gate/device_scan_batch", methods=["POST"])
+def device_scan_batch():
+    """
+    Đồng bộ các lượt quẹt ESP32 lưu tạm khi mất WiFi: {"device_id", "swipes": [{"card_id", "ts"}, ...]}.
+    Cả lô ghi trong một transaction; trả về kết quả từng lượt để thiết bị xóa khỏi bộ đệm.
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get("swipes"), list):
+        return jsonify({"message": "Bad request"}), 400
+
+    device, rejection = _admit_device("scan", data, {})
+    if rejection:
+        return rejection
+
+    max_items = current_app.config.get("DEVICE_BATCH_MAX_ITEMS", 200)
+    if len(data["swipes"]) > max_items:
+        return jsonify({"message": f"Tối đa {max_items} lượt mỗi lô"}), 413
+
+    conn = get_db_connection()
+    try:
+        results = ingest_swipes(
+            conn,
+            device,
+            data["swipes"],
+            get_card_registry(),
+            get_settings_service(),
+            current_app.config.get("DEVICE_BATCH_MAX_AGE", 7 * 24 * 3600),
+        )
+        conn.commit()
+    except Exception as exc:
+        conn.rollback()
+        current_app.logger.error("Lỗi tại /api/gate/device_scan_batch: %s", exc)
+        return jsonify({"message": "Lỗi server"}), 500
+    finally:
+        conn.close()
+
+    recorded = sum(1 for result in results if result.get("status") in ("entry_recorded", "exit_recorded"))
+    return jsonify({"recorded": recorded, "results": results})
+
+
 @api_bp.route("/api/gate/check_action_status", methods=["GET"])
 def check_action_status():
     """ESP32 poll để kiểm tra bảo vệ đã duyệt chưa."""
+    # Firmware cũ không gửi token khi hỏi trạng thái: chỉ chấp nhận khi còn cho phép token chung.
+    _, rejection = _admit_device("status", request.args, {"status": "error"}, require_token=False)
+    if rejection:
+        return rejection
+
     poll_id = request.args.get("id")
     if not poll_id:
         return jsonify({"status": "error"}), 400
 
-    conn = get_db_connection()
-    action = conn.execute("SELECT status FROM pending_actions WHERE id = ?", (poll_id,)).fetchone()
+    try:
+        poll_id = int(poll_id)
+    except ValueError:
+        return jsonify({"status": "error"}), 400
 
-    if not action:
-        conn.close()
-        return jsonify({"status": "denied"})
+    return jsonify({"status": get_action_queue().consume(poll_id)})
 
-    status = action["status"]
 
-    if status in ("approved", "denied"):
-        conn.execute("DELETE FROM pending_actions WHERE id = ?", (poll_id,))
-        conn.commit()
+@api_bp.route("/api/gate/wait_action_status", methods=["GET"])
+def wait_action_status():
+    """
+    Long-poll: giữ request tới khi bảo vệ duyệt/hủy hoặc hết `timeout` giây.
+    Chờ trên hàng đợi trong bộ nhớ; kết quả do worker khác ghi được đọc lại từ DB mỗi LONGPOLL_RECHECK_INTERVAL giây.
+    """
+    _, rejection = _admit_device("status", request.args, {"status": "error"}, require_token=False)
+    if rejection:
+        return rejection
+
+    try:
+        poll_id = int(request.args.get("id", ""))
+    except ValueError:
+        return jsonify({"status": "error"}), 400
+
+    max_timeout = current_app.config.get("LONGPOLL_MAX_TIMEOUT", 25.0)
+    try:
+        timeout = min(float(request.args.get("timeout", max_timeout)), max_timeout)
+    except ValueError:
+        timeout = max_timeout
+    recheck_interval = current_app.config.get("LONGPOLL_RECHECK_INTERVAL", 5.0)
+
+    queue = get_action_queue()
+    status = queue.consume(poll_id)
+    deadline = time.monotonic() + timeout
+    while status not in FINAL_ACTION_STATUSES:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        queue.wait(poll_id, min(remaining, recheck_interval))
+        status = queue.consume(poll_id)
 
-    conn.close()
     return jsonify({"status": status})
 
 
@@ -1,10 +1,16 @@
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
 
-from flask import Blueprint, jsonify, render_template, request, session, url_for
+from flask import Blueprint, Response, current_app, jsonify, render_template, request, session, url_for
 
 from app.database import get_db_connection
+from app.services.action_queue import ALERT_STATUSES, get_action_queue, lane_key, parse_lanes, subscribed
 from app.services.camera import capture_snapshot
-from app.utils import login_required, role_required
+from app.services.card_registry import get_card_registry
+from app.services.events import format_sse, get_event_broadcaster
+from app.services.rollups import record_entry, record_exit
+from app.services.snapshot_writer import get_snapshot_writer
+from app.utils import login_required, role_required, vn_ts
 
 security_bp = Blueprint("security", __name__)
 
@@ -13,34 +19,30 @@ security_bp = Blueprint("security", __name__)
 @login_required
 @role_required("security")
 def security_dashboard():
-    return render_template("security_dashboard.html")
+    # ?lanes=G1,G2/out: chỉ nhận yêu cầu của các cổng/làn này (bỏ trống = mọi làn).
+    return render_template("security_dashboard.html", lanes=",".join(parse_lanes(request.args.get("lanes")) or ()))
+
+
+def _guard_subscription():
+    """(mã bảo vệ, các làn đăng ký) của màn hình đang gọi; ?guard= phân biệt nhiều tab dùng chung tài khoản."""
+    guard = f"{session['username']}:{request.args.get('guard', '')}"
+    return guard, parse_lanes(request.args.get("lanes"))
 
 
 @security_bp.route("/api/gate/get_pending_scans", methods=["GET"])
 @login_required
 @role_required("security")
 def get_pending_scans():
-    """API Polling: Trả về xe chờ duyệt HOẶC cảnh báo thẻ lạ."""
+    """API Polling: Trả về xe chờ duyệt HOẶC cảnh báo thẻ lạ trong các làn bảo vệ đăng ký."""
+    guard, lanes = _guard_subscription()
     conn = get_db_connection()
 
-    # 1. Dọn dẹp các yêu cầu cũ quá 2 phút
-    two_min_ago = (datetime.now() - timedelta(minutes=2)).strftime("%Y-%m-%d %H:%M:%S")
-    conn.execute(
-        "DELETE FROM pending_actions WHERE status IN ('pending', 'alert_unregistered', 'alert_lost') AND created_at < ?",
-        (two_min_ago,),
-    )
-    conn.commit()
-
-    # 2. Lấy yêu cầu mới nhất (bao gồm cả 'pending' VÀ 'alert_unregistered')
-    pending = conn.execute(
-        "SELECT * FROM pending_actions WHERE status IN ('pending', 'alert_unregistered', 'alert_lost') ORDER BY created_at ASC LIMIT 1"
-    ).fetchone()
+    # Lấy yêu cầu còn hạn (bao gồm cả 'pending' VÀ cảnh báo) từ hàng đợi trong bộ nhớ, chia đều giữa các làn/bảo vệ.
+    pending = get_action_queue().claim_next(conn, guard, lanes)
 
     if pending:
         # === TRƯỜNG HỢP 1: CẢNH BÁO THẺ LẠ ===
-        if pending["status"] in ("alert_unregistered", "alert_lost"):
-            conn.execute("DELETE FROM pending_actions WHERE id = ?", (pending["id"],))
-            conn.commit()
+        if pending["status"] in ALERT_STATUSES:
             conn.close()
 
             alert_message = (
@@ -52,27 +54,24 @@ def get_pending_scans():
                 {
                     "action_type": "alert",
                     "card_id": pending["card_id"],
+                    "gate_id": pending["gate_id"],
+                    "lane": pending["lane"],
                     "message": alert_message,
                 }
             )
 
         # === TRƯỜNG HỢP 2: XE CHỜ DUYỆT (Bình thường) ===
-        conn.execute("UPDATE pending_actions SET status = 'processing' WHERE id = ?", (pending["id"],))
-        conn.commit()
-
         if pending["action_type"] == "entry":
-            card_info = conn.execute(
-                "SELECT holder_name, license_plate, ticket_type FROM cards WHERE card_id = ?", (pending["card_id"],)
-            ).fetchone()
+            card_info = get_card_registry().get(conn, pending["card_id"])
 
             holder_name = "Khách vãng lai"
             license_plate = None
             ticket_type = "daily"
 
             if card_info:
-                holder_name = card_info["holder_name"] or "N/A"
-                license_plate = card_info["license_plate"]
-                ticket_type = card_info["ticket_type"]
+                holder_name = card_info.holder_name or "N/A"
+                license_plate = card_info.license_plate
+                ticket_type = card_info.ticket_type
 
             conn.close()
             return jsonify(
@@ -80,9 +79,9 @@ def get_pending_scans():
                     "poll_id": pending["id"],
                     "action_type": "entry",
                     "card_id": pending["card_id"],
-                    "entry_time": datetime.strptime(pending["created_at"], "%Y-%m-%d %H:%M:%S").strftime(
-                        "%d/%m/%Y %H:%M:%S"
-                    ),
+                    "gate_id": pending["gate_id"],
+                    "lane": pending["lane"],
+                    "entry_time": vn_ts(pending["created_ts"]),
                     "holder_name": holder_name,
                     "license_plate": license_plate,
                     "ticket_type": ticket_type,
@@ -96,8 +95,8 @@ def get_pending_scans():
                 if entry_snapshot and entry_snapshot["entry_snapshot"]
                 else url_for("static", filename="placeholder.jpg")
             )
-            card_info = conn.execute("SELECT ticket_type FROM cards WHERE card_id = ?", (pending["card_id"],)).fetchone()
-            ticket_type = card_info["ticket_type"] if card_info else "daily"
+            card_info = get_card_registry().get(conn, pending["card_id"])
+            ticket_type = card_info.ticket_type if card_info else "daily"
 
             conn.close()
             return jsonify(
@@ -105,12 +104,12 @@ def get_pending_scans():
                     "poll_id": pending["id"],
                     "action_type": "exit",
                     "card_id": pending["card_id"],
+                    "gate_id": pending["gate_id"],
+                    "lane": pending["lane"],
                     "transaction_id": pending["transaction_id"],
                     "license_plate": pending["license_plate"],
                     "entry_time": pending["entry_time"],
-                    "exit_time": datetime.strptime(pending["created_at"], "%Y-%m-%d %H:%M:%S").strftime(
-                        "%d/%m/%Y %H:%M:%S"
-                    ),
+                    "exit_time": vn_ts(pending["created_ts"]),
                     "duration": pending["duration"],
                     "fee": pending["fee"],
                     "entry_snapshot_url": entry_snapshot_url,
@@ -122,6 +121,73 @@ def get_pending_scans():
     return jsonify(None)
 
 
+@security_bp.route("/api/gate/events", methods=["GET"])
+@login_required
+@role_required("security")
+def gate_events():
+    """
+    Kênh SSE đẩy yêu cầu vào/ra/cảnh báo mới tới màn hình bảo vệ.
+    Nối lại bằng Last-Event-ID (hoặc ?last_id=) = id của pending_actions; phần bỏ lỡ lấy từ hàng đợi trong bộ nhớ.
+    Chỉ đẩy sự kiện của các làn đăng ký (?lanes=); kết nối còn mở được tính là bảo vệ đang trực khi chia việc.
+    Bộ phát sự kiện chỉ thấy yêu cầu của tiến trình này, nên khi ACTION_QUEUE_SHARED_DB bật, kênh còn đọc
+    pending_actions có id lớn hơn mốc đã gửi mỗi SSE_DB_POLL_INTERVAL giây để nhận yêu cầu của worker khác.
+    """
+    guard, lanes = _guard_subscription()
+    queue = get_action_queue()
+    broadcaster = get_event_broadcaster()
+    heartbeat = current_app.config.get("SSE_HEARTBEAT_INTERVAL", 15.0)
+    db_poll = current_app.config.get("SSE_DB_POLL_INTERVAL", 2.0) if queue.shared_db else None
+    raw_last_id = request.headers.get("Last-Event-ID") or request.args.get("last_id")
+
+    backlog = []
+    try:
+        last_id = int(raw_last_id) if raw_last_id else None
+    except ValueError:
+        last_id = None
+
+    if last_id is None:
+        last_id = queue.latest_id() if queue.shared_db else broadcaster.latest_id
+    else:
+        backlog = queue.open_since(last_id, lanes)
+        if backlog:
+            last_id = max(last_id, backlog[-1]["id"])
+
+    def stream(cursor_id):
+        yield "retry: 3000\n\n"
+        for payload in backlog:
+            yield format_sse(payload["id"], payload["action_type"], payload)
+        idle_since = time.monotonic()
+        while True:
+            queue.touch_guard(guard, lanes)
+            if db_poll is None:
+                events = broadcaster.wait_since(cursor_id, timeout=heartbeat)
+            else:
+                # Sự kiện trong tiến trình chỉ dùng để thức dậy sớm; nội dung lấy từ DB theo id tăng dần.
+                # Yêu cầu của tiến trình này đã được nhận xong thì không còn trong DB: vẫn nhảy mốc qua chúng
+                # (mọi id nhỏ hơn đã commit trước) để không bị đánh thức lại liên tục.
+                broadcaster.wait_since(cursor_id, timeout=db_poll)
+                local_latest = broadcaster.latest_id
+                events = [(payload["id"], payload) for payload in queue.open_since(cursor_id)]
+                cursor_id = max(cursor_id, local_latest)
+            if not events:
+                if time.monotonic() - idle_since >= heartbeat or db_poll is None:
+                    idle_since = time.monotonic()
+                    yield ": ping\n\n"
+                continue
+            idle_since = time.monotonic()
+            queue.touch_guard(guard, lanes)
+            for event_id, payload in events:
+                if subscribed(lane_key(payload["gate_id"], payload["lane"]), lanes):
+                    yield format_sse(event_id, payload["action_type"], payload)
+                cursor_id = max(cursor_id, event_id)
+
+    return Response(
+        stream(last_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @security_bp.route("/api/confirm_pending_entry", methods=["POST"])
 @login_required
 @role_required("security")
@@ -133,23 +199,27 @@ def confirm_pending_entry():
     license_plate = data["license_plate"]
     conn = get_db_connection()
     try:
-        entry_snapshot_filename = capture_snapshot(card_id, "in")
+        entry_snapshot = capture_snapshot(card_id, "in")
         entry_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        card_info = conn.execute("SELECT * FROM cards WHERE card_id = ?", (card_id,)).fetchone()
+        registry = get_card_registry()
+        card_info = registry.get(conn, card_id)
         if not card_info:
             conn.execute(
                 "INSERT INTO cards (card_id, holder_name, ticket_type, status, created_at) VALUES (?, ?, ?, ?, ?)",
                 (card_id, f"Khách vãng lai {license_plate}", "daily", "active", entry_time),
             )
+            registry.invalidate(conn, card_id)
 
-        conn.execute(
-            "INSERT INTO transactions (card_id, license_plate, entry_time, security_user, entry_snapshot) VALUES (?, ?, ?, ?, ?)",
-            (card_id, license_plate, entry_time, session["username"], entry_snapshot_filename),
+        transaction = conn.execute(
+            """INSERT INTO transactions (card_id, license_plate, entry_time, security_user, entry_snapshot, entry_snapshot_status)
+               VALUES (?, ?, ?, ?, ?, 'pending')""",
+            (card_id, license_plate, entry_time, session["username"], entry_snapshot.filename),
         )
+        record_entry(conn, entry_time)
 
-        conn.execute("UPDATE pending_actions SET status = 'approved' WHERE id = ?", (poll_id,))
-        conn.commit()
+        get_action_queue().resolve(conn, int(poll_id), "approved")
+        get_snapshot_writer().submit(entry_snapshot, transaction.lastrowid, "entry")
         return jsonify({"status": "success", "message": f"Đã ghi nhận xe {license_plate} vào bãi."})
     except Exception as exc:
         conn.rollback()
@@ -166,8 +236,7 @@ def cancel_pending_action():
     data = request.get_json()
     poll_id = data["poll_id"]
     conn = get_db_connection()
-    conn.execute("UPDATE pending_actions SET status = 'denied' WHERE id = ?", (poll_id,))
-    conn.commit()
+    get_action_queue().resolve(conn, int(poll_id), "denied")
     conn.close()
     return jsonify({"status": "success"})
 
@@ -189,16 +258,23 @@ def confirm_pending_exit():
             conn.close()
             return jsonify({"message": "Giao dịch không tồn tại hoặc đã được xử lý."}), 404
 
-        exit_snapshot_filename = capture_snapshot(transaction["card_id"], "out")
+        exit_snapshot = capture_snapshot(transaction["card_id"], "out")
         exit_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        conn.execute(
-            "UPDATE transactions SET exit_time = ?, fee = ?, security_user = ?, exit_snapshot = ? WHERE id = ?",
-            (exit_time, fee, session["username"], exit_snapshot_filename, transaction_id),
+        updated = conn.execute(
+            """UPDATE transactions
+               SET exit_time = ?, fee = ?, security_user = ?, exit_snapshot = ?, exit_snapshot_status = 'pending'
+               WHERE id = ? AND exit_time IS NULL""",
+            (exit_time, fee, session["username"], exit_snapshot.filename, transaction_id),
         )
+        if updated.rowcount != 1:
+            # Hai màn hình cùng xác nhận một lượt ra: chỉ lượt đầu tiên được ghi (và cộng vào thống kê).
+            conn.rollback()
+            return jsonify({"message": "Giao dịch không tồn tại hoặc đã được xử lý."}), 404
+        record_exit(conn, exit_time, fee)
 
-        conn.execute("UPDATE pending_actions SET status = 'approved' WHERE id = ?", (poll_id,))
-        conn.commit()
+        get_action_queue().resolve(conn, int(poll_id), "approved")
+        get_snapshot_writer().submit(exit_snapshot, transaction_id, "exit")
         return jsonify({"status": "success", "message": "Giao dịch thành công!"})
     except Exception as exc:
         conn.rollback()
@@ -0,0 +1,532 @@
+import logging
+import sqlite3
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+
+from flask import Flask, current_app
+
+from app.database import pooled_connection
+from app.services.events import build_pending_event, publish_pending_action
+from app.services.maintenance import OPEN_ACTION_STATUSES, pending_action_cutoff
+from app.utils import to_epoch
+
+logger = logging.getLogger(__name__)
+
+# Thiết bị cũ không gửi gate_id/lane được xếp chung vào cổng mặc định.
+DEFAULT_GATE = "default"
+ALERT_STATUSES = ("alert_unregistered", "alert_lost")
+FINAL_ACTION_STATUSES = ("approved", "denied")
+
+# Bảo vệ không hỏi việc/không giữ kênh SSE quá chừng này giây thì bị bỏ khỏi danh sách trực.
+GUARD_RETENTION_SECONDS = 600
+# Bản lặp đến khi lượt quẹt đầu còn đang xử lý chờ tối đa chừng này giây để nhận cùng phản hồi.
+SCAN_RESERVATION_WAIT = 5.0
+# Số yêu cầu còn chờ đọc từ DB mỗi lần hàng đợi trong bộ nhớ không còn việc cho bảo vệ.
+DB_FALLBACK_BATCH = 20
+
+
+def lane_key(gate_id: Optional[str], lane: Optional[str]) -> str:
+    """Khóa hàng đợi của một làn: "<gate_id>/<lane>", hoặc chỉ "<gate_id>" khi thiết bị không gửi làn."""
+    gate_id = gate_id or DEFAULT_GATE
+    return f"{gate_id}/{lane}" if lane else gate_id
+
+
+def parse_lanes(raw: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Đăng ký làn của bảo vệ từ chuỗi "G1,G2/out" (cả cổng hoặc từng làn); rỗng = mọi làn."""
+    lanes = tuple(token.strip().strip("/") for token in (raw or "").split(",") if token.strip().strip("/"))
+    return lanes or None
+
+
+def subscribed(key: str, lanes: Optional[Tuple[str, ...]]) -> bool:
+    return lanes is None or any(key == lane or key.startswith(f"{lane}/") for lane in lanes)
+
+
+class GuardState:
+    __slots__ = ("lanes", "last_seen", "last_served", "cursor", "holding")
+
+    def __init__(self):
+        self.lanes: Optional[Tuple[str, ...]] = None
+        self.last_seen = 0.0
+        self.last_served = 0.0
+        self.cursor = ""
+        self.holding: Optional[int] = None
+
+
+class ActionQueue:
+    """
+    Hàng đợi yêu cầu chờ duyệt (vào/ra/cảnh báo) giữ trong bộ nhớ theo làn, có Condition cho các request chờ.
+    Bảng pending_actions chỉ là bản ghi ghi-trước (write-through) để khôi phục khi khởi động lại:
+    ESP32 và màn hình bảo vệ đọc từ bộ nhớ. Khi chạy nhiều worker chung một DB (shared_db, ACTION_QUEUE_SHARED_DB)
+    thì DB là nguồn chung: bảo vệ hết việc trong bộ nhớ thì đọc thêm yêu cầu còn chờ từ DB (do worker khác nhận),
+    và ESP32 chỉ tin kết quả cuối cùng trong bộ nhớ, còn lại đọc DB theo khóa chính. Việc nhận yêu cầu luôn là
+    UPDATE/DELETE có điều kiện trạng thái nên hai worker không nhận trùng.
+
+    Chia việc cho nhiều bảo vệ: mỗi bảo vệ duyệt lần lượt (round-robin) các làn mình đăng ký, nên làn đông
+    không chặn làn khác; yêu cầu mới được giữ tối đa `hold_seconds` cho bảo vệ đang rảnh đã lâu chưa được
+    giao việc, để một màn hình hỏi nhanh hơn không ôm hết yêu cầu.
+    """
+
+    def __init__(
+        self,
+        app: Flask,
+        hold_seconds: float = 3.0,
+        guard_active_seconds: float = 45.0,
+        dedupe_window: float = 10.0,
+        idempotency_ttl: float = 300.0,
+        shared_db: bool = False,
+    ):
+        self.app = app
+        self.shared_db = shared_db
+        self.hold_seconds = hold_seconds
+        self.guard_active_seconds = guard_active_seconds
+        self.dedupe_window = dedupe_window
+        self.idempotency_ttl = idempotency_ttl
+        self._cond = threading.Condition()
+        self._actions: Dict[int, Dict[str, object]] = {}
+        self._lanes: Dict[str, Deque[int]] = {}
+        self._guards: Dict[str, GuardState] = {}
+        # Phản hồi device_scan gần nhất theo (thiết bị, thẻ) và theo (thiết bị, idempotency key): (thời điểm, poll_id, phản hồi).
+        self._recent_scans: Dict[Tuple[str, str], Tuple[float, Optional[int], Dict[str, object]]] = {}
+        self._idempotent_scans: Dict[Tuple[str, str], Tuple[float, Optional[int], Dict[str, object]]] = {}
+        self.duplicate_scans = 0
+
+    def _track(self, action: Dict[str, object]) -> None:
+        action.setdefault("queued_at", time.monotonic())
+        self._actions[action["id"]] = action
+        if action["status"] in OPEN_ACTION_STATUSES:
+            self._lanes.setdefault(lane_key(action.get("gate_id"), action.get("lane")), deque()).append(action["id"])
+
+    def restore(self, conn) -> int:
+        """Nạp lại các yêu cầu còn hạn từ pending_actions (khi khởi động); trả về số yêu cầu đã nạp."""
+        rows = conn.execute(
+            "SELECT * FROM pending_actions WHERE created_ts >= ? ORDER BY id", (pending_action_cutoff(self.app),)
+        ).fetchall()
+        with self._cond:
+            for row in rows:
+                self._track(dict(row))
+        return len(rows)
+
+    def submit(
+        self,
+        conn,
+        card_id: str,
+        status: str,
+        action_type: str,
+        gate_id: Optional[str] = None,
+        lane: Optional[str] = None,
+        **extra,
+    ) -> int:
+        """
+        Ghi yêu cầu vào pending_actions (commit), đưa vào hàng đợi của làn rồi đẩy sự kiện SSE; trả về poll_id.
+        Cột idempotency_key là UNIQUE: nếu worker khác đã ghi yêu cầu cùng khóa thì trả về poll_id của yêu cầu đó.
+        """
+        row = {
+            "card_id": card_id,
+            "status": status,
+            "action_type": action_type,
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "gate_id": gate_id or DEFAULT_GATE,
+            "lane": lane or None,
+            **extra,
+        }
+        columns = ", ".join(row)
+        placeholders = ", ".join("?" for _ in row)
+        try:
+            cursor = conn.execute(
+                f"INSERT INTO pending_actions ({columns}) VALUES ({placeholders})", tuple(row.values())
+            )
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            existing = (
+                conn.execute(
+                    "SELECT id FROM pending_actions WHERE idempotency_key = ?", (row["idempotency_key"],)
+                ).fetchone()
+                if row.get("idempotency_key")
+                else None
+            )
+            if existing is None:
+                raise
+            with self._cond:
+                self.duplicate_scans += 1
+            return existing["id"]
+        conn.commit()
+
+        action = dict(
+            row,
+            id=cursor.lastrowid,
+            created_ts=to_epoch(datetime.strptime(row["created_at"], "%Y-%m-%d %H:%M:%S")),
+        )
+        with self._cond:
+            self._track(action)
+            self._cond.notify_all()
+        publish_pending_action(action["id"], row)
+        return action["id"]
+
+    def _duplicate_of(
+        self, device: str, card_id: str, idempotency_key: Optional[str], now: float
+    ) -> Optional[Tuple[float, Optional[int], Optional[Dict[str, object]]]]:
+        hit = self._idempotent_scans.get((device, idempotency_key)) if idempotency_key else None
+        if hit and now - hit[0] < self.idempotency_ttl:
+            return hit
+        hit = self._recent_scans.get((device, card_id))
+        if hit and now - hit[0] < self.dedupe_window:
+            poll_id = hit[1]
+            # Cảnh báo (và lượt đang xử lý) không có poll_id: chỉ xét cửa sổ thời gian.
+            # Yêu cầu đã có kết quả thì lượt quẹt mới là hợp lệ.
+            if poll_id is None or self._actions.get(poll_id, {}).get("status") in OPEN_ACTION_STATUSES + ("processing",):
+                return hit
+        return None
+
+    def recall_scan(self, device: str, card_id: str, idempotency_key: Optional[str] = None) -> Optional[Dict[str, object]]:
+        """
+        Phản hồi cũ nếu lượt quẹt này là bản lặp: cùng idempotency key (trong idempotency_ttl), hoặc cùng thiết bị
+        và thẻ trong dedupe_window giây khi yêu cầu trước vẫn đang chờ bảo vệ. Không đụng tới DB.
+        Lượt không phải bản lặp được giữ chỗ ngay trong cùng lock, nên bản lặp đến đồng thời chờ phản hồi của lượt
+        đầu (tối đa SCAN_RESERVATION_WAIT giây) thay vì tạo thêm yêu cầu; bên gọi phải remember_scan hoặc release_scan.
+        """
+        deadline = time.monotonic() + SCAN_RESERVATION_WAIT
+        with self._cond:
+            while True:
+                hit = self._duplicate_of(device, card_id, idempotency_key, time.monotonic())
+                if hit is None:
+                    break
+                if hit[2] is not None:
+                    self.duplicate_scans += 1
+                    return hit[2]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # Lượt đầu treo quá lâu: xử lý lượt này như lượt mới.
+                    break
+                self._cond.wait(remaining)
+            reservation = (time.monotonic(), None, None)
+            self._recent_scans[(device, card_id)] = reservation
+            if idempotency_key:
+                self._idempotent_scans[(device, idempotency_key)] = reservation
+        return None
+
+    def remember_scan(
+        self,
+        device: str,
+        card_id: str,
+        idempotency_key: Optional[str],
+        response: Dict[str, object],
+        poll_id: Optional[int] = None,
+    ) -> None:
+        entry = (time.monotonic(), poll_id, response)
+        with self._cond:
+            self._recent_scans[(device, card_id)] = entry
+            if idempotency_key:
+                self._idempotent_scans[(device, idempotency_key)] = entry
+            self._cond.notify_all()
+
+    def release_scan(self, device: str, card_id: str, idempotency_key: Optional[str]) -> None:
+        """Bỏ chỗ đã giữ khi xử lý lượt quẹt lỗi, để bản lặp đang chờ được xử lý như lượt mới."""
+        with self._cond:
+            for scans, key in ((self._recent_scans, (device, card_id)), (self._idempotent_scans, (device, idempotency_key))):
+                if scans.get(key, (0, None, {}))[2] is None:
+                    del scans[key]
+            self._cond.notify_all()
+
+    def _guard(self, guard: str, lanes: Optional[Tuple[str, ...]], now: float) -> GuardState:
+        state = self._guards.get(guard)
+        if state is None:
+            state = self._guards[guard] = GuardState()
+        state.lanes = lanes
+        state.last_seen = now
+        return state
+
+    def touch_guard(self, guard: str, lanes: Optional[Tuple[str, ...]]) -> None:
+        """Đánh dấu bảo vệ đang trực (gọi từ kênh SSE) để được tính khi chia việc."""
+        with self._cond:
+            self._guard(guard, lanes, time.monotonic())
+
+    def _head(self, key: str, cutoff: int) -> Optional[Dict[str, object]]:
+        queue = self._lanes.get(key)
+        while queue:
+            action = self._actions.get(queue[0])
+            if action is None or action["status"] not in OPEN_ACTION_STATUSES:
+                queue.popleft()
+            elif action["created_ts"] < cutoff:
+                # Quá hạn chỉ bị bỏ khỏi bộ nhớ; việc xóa trong DB do job expire_pending_actions đảm nhận.
+                self._actions.pop(queue.popleft(), None)
+            else:
+                return action
+        return None
+
+    def _defer(self, guard: str, state: GuardState, key: str, action: Dict[str, object], now: float) -> bool:
+        """True nếu nên để yêu cầu này cho một bảo vệ khác đang rảnh và đã chờ việc lâu hơn."""
+        if now - action["queued_at"] >= self.hold_seconds:
+            return False
+        for other_id, other in self._guards.items():
+            if (
+                other_id != guard
+                and other.holding is None
+                and now - other.last_seen <= self.guard_active_seconds
+                and other.last_served < state.last_served
+                and subscribed(key, other.lanes)
+            ):
+                return True
+        return False
+
+    def _claim_local(
+        self, guard: Optional[str], lanes: Optional[Tuple[str, ...]], cutoff: int
+    ) -> Optional[Dict[str, object]]:
+        now = time.monotonic()
+        with self._cond:
+            state = None
+            if guard is not None:
+                state = self._guard(guard, lanes, now)
+                # Bảo vệ hỏi việc mới nghĩa là đã xong yêu cầu đang giữ.
+                state.holding = None
+
+            keys = sorted(key for key in self._lanes if subscribed(key, lanes))
+            if state is not None:
+                start = bisect_right(keys, state.cursor)
+                keys = keys[start:] + keys[:start]
+
+            action = None
+            for key in keys:
+                head = self._head(key, cutoff)
+                if head is None or (state is not None and self._defer(guard, state, key, head, now)):
+                    continue
+                action = head
+                self._lanes[key].popleft()
+                if state is not None:
+                    state.cursor = key
+                    state.last_served = now
+                break
+            if action is None:
+                return None
+
+            claimed = dict(action)
+            if action["status"] in ALERT_STATUSES:
+                self._actions.pop(action["id"], None)
+            else:
+                action["status"] = "processing"
+                action["guard"] = guard
+                if state is not None:
+                    state.holding = action["id"]
+        return claimed
+
+    @staticmethod
+    def _mark_claimed(conn, action: Dict[str, object]) -> bool:
+        """Ghi việc nhận yêu cầu vào DB; False nếu worker khác đã nhận trước (trạng thái trong DB đã đổi)."""
+        if action["status"] in ALERT_STATUSES:
+            cursor = conn.execute("DELETE FROM pending_actions WHERE id = ? AND status = ?", (action["id"], action["status"]))
+        else:
+            cursor = conn.execute(
+                "UPDATE pending_actions SET status = 'processing' WHERE id = ? AND status = ?",
+                (action["id"], action["status"]),
+            )
+        conn.commit()
+        return cursor.rowcount == 1
+
+    def _claim_from_db(
+        self, conn, guard: Optional[str], lanes: Optional[Tuple[str, ...]], cutoff: int
+    ) -> Optional[Dict[str, object]]:
+        """Nhận yêu cầu còn chờ mà tiến trình này không giữ trong bộ nhớ (tạo ở worker khác)."""
+        placeholders = ", ".join("?" for _ in OPEN_ACTION_STATUSES)
+        rows = conn.execute(
+            f"SELECT * FROM pending_actions WHERE status IN ({placeholders}) AND created_ts >= ? ORDER BY id LIMIT ?",
+            (*OPEN_ACTION_STATUSES, cutoff, DB_FALLBACK_BATCH),
+        ).fetchall()
+        for row in rows:
+            key = lane_key(row["gate_id"], row["lane"])
+            with self._cond:
+                # Yêu cầu có trong bộ nhớ đã được xét (hoặc đang được giữ cho bảo vệ khác) ở bước trước.
+                if row["id"] in self._actions or not subscribed(key, lanes):
+                    continue
+            claimed = dict(row)
+            if not self._mark_claimed(conn, claimed):
+                continue
+            with self._cond:
+                if claimed["status"] not in ALERT_STATUSES:
+                    self._track(dict(claimed, status="processing", guard=guard))
+                state = self._guards.get(guard) if guard is not None else None
+                if state is not None:
+                    state.cursor = key
+                    state.last_served = time.monotonic()
+                    if claimed["status"] not in ALERT_STATUSES:
+                        state.holding = claimed["id"]
+            return claimed
+        return None
+
+    def claim_next(
+        self, conn, guard: Optional[str] = None, lanes: Optional[Tuple[str, ...]] = None
+    ) -> Optional[Dict[str, object]]:
+        """
+        Lấy một yêu cầu còn hạn cho bảo vệ `guard` trong các làn `lanes` (None = mọi làn): các làn được duyệt
+        vòng tròn tiếp sau làn vừa phục vụ, trong mỗi làn lấy yêu cầu cũ nhất; hết việc trong bộ nhớ thì đọc DB.
+        Cảnh báo bị xóa khi đọc; yêu cầu vào/ra chuyển sang 'processing'. Trả về bản sao yêu cầu (trạng thái lúc lấy).
+        """
+        cutoff = pending_action_cutoff(self.app)
+        while True:
+            claimed = self._claim_local(guard, lanes, cutoff)
+            if claimed is None:
+                return self._claim_from_db(conn, guard, lanes, cutoff) if self.shared_db else None
+            if self._mark_claimed(conn, claimed):
+                return claimed
+            with self._cond:
+                self._actions.pop(claimed["id"], None)
+                state = self._guards.get(guard) if guard is not None else None
+                if state is not None and state.holding == claimed["id"]:
+                    state.holding = None
+
+    def resolve(self, conn, poll_id: int, status: str) -> None:
+        """
+        Ghi kết quả duyệt/hủy rồi commit (cùng transaction với các thay đổi bên gọi đã thực hiện trên `conn`),
+        sau đó đánh thức các request đang chờ poll_id.
+        """
+        conn.execute("UPDATE pending_actions SET status = ? WHERE id = ?", (status, poll_id))
+        conn.commit()
+        with self._cond:
+            action = self._actions.get(poll_id)
+            if action is None:
+                action = self._actions[poll_id] = {"id": poll_id, "created_ts": to_epoch(datetime.now())}
+            action["status"] = status
+            holder = self._guards.get(action.get("guard"))
+            if holder is not None and holder.holding == poll_id:
+                holder.holding = None
+            self._cond.notify_all()
+
+    def consume(self, poll_id: int) -> str:
+        """
+        Trạng thái yêu cầu cho ESP32; kết quả cuối cùng chỉ được trả một lần rồi xóa khỏi hàng đợi và DB.
+        Kết quả cuối cùng trong bộ nhớ là do chính tiến trình này ghi nên trả ngay. Trạng thái còn chờ trong bộ nhớ
+        cũng trả ngay, trừ khi shared_db (worker khác có thể đã duyệt) thì đọc lại DB theo khóa chính.
+        """
+        with self._cond:
+            action = self._actions.get(poll_id)
+            status = action["status"] if action else None
+            if status in FINAL_ACTION_STATUSES:
+                self._actions.pop(poll_id, None)
+
+        if status is not None and status not in FINAL_ACTION_STATUSES and not self.shared_db:
+            return status
+
+        with pooled_connection(self.app) as conn:
+            if status not in FINAL_ACTION_STATUSES:
+                row = conn.execute("SELECT status FROM pending_actions WHERE id = ?", (poll_id,)).fetchone()
+                if not row:
+                    return "denied"
+                status = row["status"]
+                if status not in FINAL_ACTION_STATUSES:
+                    return status
+                with self._cond:
+                    self._actions.pop(poll_id, None)
+            conn.execute("DELETE FROM pending_actions WHERE id = ?", (poll_id,))
+            conn.commit()
+        return status
+
+    def wait(self, poll_id: int, timeout: float) -> bool:
+        """Chờ tối đa `timeout` giây tới khi poll_id có kết quả cuối cùng trong bộ nhớ."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._actions.get(poll_id, {}).get("status") in FINAL_ACTION_STATUSES, timeout=timeout
+            )
+
+    def latest_id(self) -> int:
+        """id lớn nhất trong pending_actions (mọi worker); dùng làm mốc đầu cho kênh SSE khi shared_db."""
+        with pooled_connection(self.app) as conn:
+            return conn.execute("SELECT IFNULL(MAX(id), 0) FROM pending_actions").fetchone()[0]
+
+    def open_since(self, last_id: int, lanes: Optional[Tuple[str, ...]] = None) -> List[Dict[str, object]]:
+        """
+        Các yêu cầu còn chờ có id > last_id trong các làn `lanes` (payload SSE) cho màn hình bảo vệ nối lại.
+        Khi shared_db đọc từ pending_actions (theo khóa chính) để thấy cả yêu cầu do worker khác nhận.
+        """
+        if self.shared_db:
+            placeholders = ", ".join("?" for _ in OPEN_ACTION_STATUSES)
+            with pooled_connection(self.app) as conn:
+                rows = conn.execute(
+                    f"SELECT * FROM pending_actions WHERE id > ? AND status IN ({placeholders}) ORDER BY id",
+                    (last_id, *OPEN_ACTION_STATUSES),
+                ).fetchall()
+            return [
+                build_pending_event(row)
+                for row in rows
+                if subscribed(lane_key(row["gate_id"], row["lane"]), lanes)
+            ]
+        with self._cond:
+            actions = sorted(
+                (action for action in self._actions.values() if action["id"] > last_id),
+                key=lambda action: action["id"],
+            )
+            return [
+                build_pending_event(action)
+                for action in actions
+                if action["status"] in OPEN_ACTION_STATUSES
+                and subscribed(lane_key(action.get("gate_id"), action.get("lane")), lanes)
+            ]
+
+    def expire(self, cutoff: int) -> int:
+        """Bỏ khỏi bộ nhớ mọi yêu cầu tạo trước mốc `cutoff` (giây epoch); DB do bên gọi dọn."""
+        with self._cond:
+            expired = [poll_id for poll_id, action in self._actions.items() if action["created_ts"] < cutoff]
+            for poll_id in expired:
+                del self._actions[poll_id]
+            for key, queue in list(self._lanes.items()):
+                if not queue:
+                    del self._lanes[key]
+            now = time.monotonic()
+            for scans, ttl in ((self._recent_scans, self.dedupe_window), (self._idempotent_scans, self.idempotency_ttl)):
+                for key in [key for key, (at, _, _) in scans.items() if now - at >= ttl]:
+                    del scans[key]
+            for guard in [guard for guard, state in self._guards.items() if now - state.last_seen > GUARD_RETENTION_SECONDS]:
+                del self._guards[guard]
+        return len(expired)
+
+    def stats(self) -> Dict[str, object]:
+        with self._cond:
+            by_status: Dict[str, int] = {}
+            for action in self._actions.values():
+                by_status[action["status"]] = by_status.get(action["status"], 0) + 1
+            lanes = {
+                key: sum(1 for poll_id in queue if self._actions.get(poll_id, {}).get("status") in OPEN_ACTION_STATUSES)
+                for key, queue in self._lanes.items()
+            }
+            now = time.monotonic()
+            guards = {
+                guard: {
+                    "lanes": list(state.lanes) if state.lanes else None,
+                    "active": now - state.last_seen <= self.guard_active_seconds,
+                    "holding": state.holding,
+                }
+                for guard, state in self._guards.items()
+            }
+        return {
+            "tracked": sum(by_status.values()),
+            "by_status": by_status,
+            "open_by_lane": lanes,
+            "guards": guards,
+            "duplicate_scans": self.duplicate_scans,
+        }
+
+
+def init_action_queue(app: Flask) -> ActionQueue:
+    """Tạo hàng đợi và nạp lại các yêu cầu còn hạn từ DB để ESP32/bảo vệ tiếp tục sau khi khởi động lại."""
+    queue = ActionQueue(
+        app,
+        hold_seconds=app.config.get("DISPATCH_HOLD_SECONDS", 3.0),
+        guard_active_seconds=app.config.get("GUARD_ACTIVE_SECONDS", 45.0),
+        dedupe_window=app.config.get("DEVICE_SCAN_DEDUPE_WINDOW", 10.0),
+        idempotency_ttl=app.config.get("DEVICE_SCAN_IDEMPOTENCY_TTL", 300.0),
+        shared_db=app.config.get("ACTION_QUEUE_SHARED_DB", False),
+    )
+    try:
+        with pooled_connection(app) as conn:
+            restored = queue.restore(conn)
+        if restored:
+            logger.info("Đã nạp lại %d yêu cầu chờ duyệt từ pending_actions.", restored)
+    except Exception as exc:
+        logger.warning("Không thể nạp lại pending_actions: %s", exc)
+    app.extensions["action_queue"] = queue
+    return queue
+
+
+def get_action_queue() -> ActionQueue:
+    return current_app.extensions["action_queue"]
@@ -1,12 +1,18 @@
 import os
 import shutil
+import threading
 import time
 import logging
+from collections import deque
 from datetime import datetime
+from typing import Dict, Optional, Tuple
 
 import cv2
+import numpy as np
 from flask import current_app
 
+from app.services.snapshot_store import placeholder_reference
+
 # Sử dụng logger chuẩn của Python để tránh lỗi context của Flask
 logger = logging.getLogger(__name__)
 
@@ -16,61 +22,97 @@ def _ensure_snapshot_dir() -> str:
     return snapshot_dir
 
 
-def _copy_placeholder(placeholder_path: str, destination_path: str, fallback_name: str) -> str:
-    """Copy ảnh placeholder sang thư mục snapshot, trả về tên file."""
-    if not os.path.exists(placeholder_path):
-        return fallback_name
-    try:
-        shutil.copy(placeholder_path, destination_path)
-        return os.path.basename(destination_path)
-    except Exception as exc:
-        logger.warning("Không thể copy placeholder: %s", exc)
-        return fallback_name
+class SnapshotJob:
+    """
+    Snapshot đã chốt tên file nhưng chưa ghi đĩa.
+    Ghi `frame` (ảnh từ camera) hoặc copy `source_path` (placeholder) tới destination_path.
+    """
+
+    __slots__ = ("filename", "destination_path", "frame", "source_path")
+
+    def __init__(self, filename: str, destination_path: str, frame=None, source_path: Optional[str] = None):
+        self.filename = filename
+        self.destination_path = destination_path
+        self.frame = frame
+        self.source_path = source_path
+
+    def write(self) -> bool:
+        """Ghi snapshot ra đĩa (chạy trong luồng nền); trả về True nếu thành công."""
+        try:
+            os.makedirs(os.path.dirname(self.destination_path), exist_ok=True)
+            if self.frame is not None:
+                return bool(cv2.imwrite(self.destination_path, self.frame))
+            if os.path.exists(self.destination_path):
+                # Blob theo địa chỉ nội dung đã có sẵn.
+                return True
+            if self.source_path and os.path.exists(self.source_path):
+                shutil.copy(self.source_path, self.destination_path)
+                return True
+            return False
+        except Exception as exc:
+            logger.warning("Không thể ghi snapshot %s: %s", self.destination_path, exc)
+            return False
 
 
-def capture_snapshot(card_id: str, event_type: str) -> str:
+def capture_snapshot(card_id: str, event_type: str) -> SnapshotJob:
     """
-    Chụp ảnh từ camera RTSP (hoặc sinh ảnh giả lập nếu bật CAMERA_TEST_MODE).
-    Hàm này chạy trong request context nên vẫn dùng current_app được.
+    Chụp ảnh từ camera RTSP (hoặc dùng ảnh giả lập nếu bật CAMERA_TEST_MODE).
+    Chỉ lấy frame trong bộ nhớ và chốt tên file; việc ghi đĩa do SnapshotWriter làm sau khi commit.
     """
     snapshot_dir = _ensure_snapshot_dir()
     placeholder_path = os.path.join(current_app.static_folder, "placeholder.jpg")
 
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = f"{card_id}_{timestamp}_{event_type}.jpg"
-    destination_path = os.path.join(snapshot_dir, filename)
+    now = datetime.now()
+    timestamp = now.strftime("%Y%m%d%H%M%S")
+    # Ảnh camera chia thư mục theo ngày (YYYY/MM/DD) để thư mục gốc không phình ra.
+    filename = f"{now:%Y/%m/%d}/{card_id}_{timestamp}_{event_type}.jpg"
+
+    def offline_job() -> SnapshotJob:
+        # Mọi snapshot offline cùng trỏ tới một blob placeholder (lưu theo địa chỉ nội dung).
+        try:
+            reference = placeholder_reference(snapshot_dir, placeholder_path)
+            return SnapshotJob(reference, os.path.join(snapshot_dir, *reference.split("/")))
+        except OSError as exc:
+            logger.warning("Không thể lưu placeholder: %s", exc)
+            offline_name = f"{card_id}_{timestamp}_{event_type}_offline.jpg"
+            return SnapshotJob(offline_name, os.path.join(snapshot_dir, offline_name), source_path=placeholder_path)
 
     # Chế độ test: luôn dùng ảnh placeholder để tránh phụ thuộc phần cứng.
     if current_app.config.get("CAMERA_TEST_MODE", True):
-        offline_name = f"{card_id}_{timestamp}_{event_type}_offline.jpg"
-        offline_path = os.path.join(snapshot_dir, offline_name)
-        return _copy_placeholder(placeholder_path, offline_path, offline_name)
+        return offline_job()
 
     rtsp_url = current_app.config["RTSP_URL_IN"]
     if event_type == "out":
         rtsp_url = current_app.config["RTSP_URL_OUT"]
 
-    cap = None
     try:
-        cap = cv2.VideoCapture(rtsp_url)
-        # Xóa buffer đầu vào cho ổn định
-        for _ in range(5):
-            cap.read()
-
-        ret, frame = cap.read()
-        if not ret or frame is None:
-            raise RuntimeError(f"Không thể đọc frame từ {rtsp_url}")
+        # Lấy frame mới nhất từ luồng đọc đang chạy sẵn, không mở RTSP trong request.
+        stream = get_camera_stream(rtsp_url, placeholder_path)
+        max_age = current_app.config.get("CAMERA_SNAPSHOT_MAX_AGE", 5.0)
+        frame = stream.latest_frame(max_age)
+        if frame is None:
+            # Luồng nguội/cũ: mở lại và chờ frame đầu tiên trong thời gian giới hạn.
+            stream.start(keep_alive=current_app.config.get("CAMERA_WARM_CAPTURE", True))
+            frame = stream.wait_frame(max_age, current_app.config.get("CAMERA_SNAPSHOT_WAIT", 3.0))
+        if frame is None:
+            raise RuntimeError(f"Chưa có frame mới từ {rtsp_url}")
 
-        cv2.imwrite(destination_path, frame)
-        return filename
+        return SnapshotJob(filename, os.path.join(snapshot_dir, *filename.split("/")), frame=frame)
     except Exception as exc:
         logger.warning("Lỗi chụp ảnh từ %s: %s", rtsp_url, exc)
-        offline_name = f"{card_id}_{timestamp}_{event_type}_offline.jpg"
-        offline_path = os.path.join(snapshot_dir, offline_name)
-        return _copy_placeholder(placeholder_path, offline_path, offline_name)
-    finally:
-        if cap:
-            cap.release()
+        return offline_job()
+
+
+def _multipart_chunk(jpeg_bytes: bytes) -> bytes:
+    """Đóng gói JPEG thành một phần của stream multipart/x-mixed-replace."""
+    return b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + bytes(jpeg_bytes) + b"\r\n"
+
+
+# Cache chunk MJPEG đã mã hóa sẵn: path -> (mtime, chunk). Ảnh đổi thì mtime đổi và được mã hóa lại.
+_chunk_cache: Dict[str, Tuple[float, bytes]] = {}
+# Frame "CAMERA OFFLINE" có nhãn cho từng camera: rtsp_url -> chunk.
+_offline_chunks: Dict[str, bytes] = {}
+_chunk_lock = threading.Lock()
 
 
 def _encode_image(path: str):
@@ -89,60 +131,231 @@ def _encode_image(path: str):
         return None
 
 
-def generate_frames(rtsp_url: str, placeholder_path: str, is_test_mode: bool):
+def _placeholder_chunk(path: str) -> Optional[bytes]:
+    """Chunk MJPEG của ảnh placeholder, chỉ đọc + mã hóa lại khi file thay đổi."""
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    with _chunk_lock:
+        cached = _chunk_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    encoded = _encode_image(path)
+    if not encoded:
+        return None
+    chunk = _multipart_chunk(encoded)
+    with _chunk_lock:
+        _chunk_cache[path] = (mtime, chunk)
+    return chunk
+
+
+def _render_offline_chunk(label: str) -> Optional[bytes]:
+    img = np.full((480, 640, 3), 128, dtype=np.uint8)
+    cv2.putText(img, "CAMERA OFFLINE", (150, 220), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 2)
+    cv2.putText(img, label, (150, 280), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 255, 255), 2)
+    flag, encoded = cv2.imencode(".jpg", img)
+    if not flag:
+        return None
+    return _multipart_chunk(encoded.tobytes())
+
+
+def prepare_offline_frames(cameras: Dict[str, str]) -> None:
+    """Vẽ sẵn frame 'CAMERA OFFLINE' (rtsp_url -> nhãn) một lần khi khởi động."""
+    for rtsp_url, label in cameras.items():
+        try:
+            chunk = _render_offline_chunk(label)
+        except Exception as exc:
+            logger.warning("Không thể tạo frame offline cho %s: %s", label, exc)
+            continue
+        if chunk:
+            with _chunk_lock:
+                _offline_chunks[rtsp_url] = chunk
+
+
+def _offline_chunk(rtsp_url: str, placeholder_path: str) -> Optional[bytes]:
+    with _chunk_lock:
+        chunk = _offline_chunks.get(rtsp_url)
+    return chunk or _placeholder_chunk(placeholder_path)
+
+
+class CameraStream:
     """
-    Trả về stream MJPEG.
-    Đã loại bỏ current_app để tránh lỗi Working outside of application context.
-    Tham số được truyền trực tiếp từ bên ngoài vào.
+    Một luồng đọc RTSP dùng chung cho mọi người xem cùng camera.
+    Mỗi frame chỉ decode/resize/encode một lần; chunk MJPEG được phát cho các subscriber qua ring buffer nhỏ,
+    client chậm chỉ lấy frame mới nhất và bỏ qua các frame đã cũ.
     """
-    cap = None
-
-    while True:
-        if is_test_mode:
-            encoded = _encode_image(placeholder_path)
-            if encoded:
-                yield (
-                    b"--frame\r\n"
-                    b"Content-Type: image/jpeg\r\n\r\n" + encoded + b"\r\n"
-                )
-            time.sleep(1)
-            continue
 
+    def __init__(self, rtsp_url: str, placeholder_path: str, buffer_size: int = 2, idle_timeout: float = 10.0):
+        self.rtsp_url = rtsp_url
+        self.placeholder_path = placeholder_path
+        self.idle_timeout = idle_timeout
+        self._frames = deque(maxlen=max(1, buffer_size))
+        self._latest_frame = None
+        self._latest_frame_at = 0.0
+        self._keep_alive = False
+        self._seq = 0
+        self._subscribers = 0
+        self._last_unsubscribe = time.monotonic()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _publish(self, chunk: bytes) -> None:
+        with self._cond:
+            self._seq += 1
+            self._frames.append((self._seq, chunk))
+            self._cond.notify_all()
+
+    def _has_subscribers(self) -> bool:
+        with self._cond:
+            return self._subscribers > 0
+
+    def _should_stop(self) -> bool:
+        with self._cond:
+            if self._keep_alive or self._subscribers > 0:
+                return False
+            if time.monotonic() - self._last_unsubscribe < self.idle_timeout:
+                return False
+            self._thread = None
+            return True
+
+    def _run(self) -> None:
+        cap = None
         try:
-            if cap is None:
-                logger.info("Kết nối camera: %s", rtsp_url)
-                cap = cv2.VideoCapture(rtsp_url)
-                if not cap.isOpened():
-                    raise ConnectionError(f"Không thể mở stream: {rtsp_url}")
-
-            ret, frame = cap.read()
-            if not ret or frame is None:
-                logger.warning("Mất kết nối %s. Đang thử lại...", rtsp_url)
-                cap.release()
-                cap = None
-                time.sleep(2)
-                continue
+            while not self._should_stop():
+                try:
+                    if cap is None:
+                        logger.info("Kết nối camera: %s", self.rtsp_url)
+                        cap = cv2.VideoCapture(self.rtsp_url)
+                        if not cap.isOpened():
+                            raise ConnectionError(f"Không thể mở stream: {self.rtsp_url}")
 
-            frame_resized = cv2.resize(frame, (640, 480))
-            flag, encoded_image = cv2.imencode(".jpg", frame_resized)
-            if not flag:
-                continue
+                    ret, frame = cap.read()
+                    if not ret or frame is None:
+                        logger.warning("Mất kết nối %s. Đang thử lại...", self.rtsp_url)
+                        cap.release()
+                        cap = None
+                        time.sleep(2)
+                        continue
 
-            yield (
-                b"--frame\r\n"
-                b"Content-Type: image/jpeg\r\n\r\n" + bytearray(encoded_image) + b"\r\n"
-            )
+                    with self._cond:
+                        self._latest_frame = frame
+                        self._latest_frame_at = time.monotonic()
+                        self._cond.notify_all()
 
-        except Exception as exc:
-            logger.warning("Lỗi stream %s: %s", rtsp_url, exc)
+                    # Không ai xem thì chỉ giữ frame cho snapshot, bỏ qua resize/encode.
+                    if not self._has_subscribers():
+                        continue
+
+                    frame_resized = cv2.resize(frame, (640, 480))
+                    flag, encoded_image = cv2.imencode(".jpg", frame_resized)
+                    if not flag:
+                        continue
+                    self._publish(_multipart_chunk(encoded_image.tobytes()))
+
+                except Exception as exc:
+                    logger.warning("Lỗi stream %s: %s", self.rtsp_url, exc)
+                    if cap:
+                        cap.release()
+                    cap = None
+
+                    chunk = _offline_chunk(self.rtsp_url, self.placeholder_path)
+                    if chunk:
+                        self._publish(chunk)
+                    time.sleep(5)
+        finally:
             if cap:
                 cap.release()
-            cap = None
-
-            encoded = _encode_image(placeholder_path)
-            if encoded:
-                yield (
-                    b"--frame\r\n"
-                    b"Content-Type: image/jpeg\r\n\r\n" + encoded + b"\r\n"
-                )
-            time.sleep(5)
\ No newline at end of file
+
+    def _ensure_running(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"camera-{self.rtsp_url}", daemon=True)
+            self._thread.start()
+
+    def start(self, keep_alive: bool = False) -> None:
+        """Khởi động luồng đọc; keep_alive giữ camera cổng luôn ấm để chụp snapshot tức thì."""
+        with self._cond:
+            self._keep_alive = self._keep_alive or keep_alive
+            # Tính từ lúc start để luồng không keep_alive còn chạy đủ idle_timeout cho snapshot.
+            self._last_unsubscribe = time.monotonic()
+            self._ensure_running()
+
+    def _fresh_frame(self, max_age: float):
+        frame = self._latest_frame
+        if frame is None or time.monotonic() - self._latest_frame_at > max_age:
+            return None
+        return frame
+
+    def latest_frame(self, max_age: float):
+        """Bản sao frame gốc mới nhất, hoặc None nếu chưa có/đã cũ hơn max_age giây."""
+        with self._cond:
+            frame = self._fresh_frame(max_age)
+            return None if frame is None else frame.copy()
+
+    def wait_frame(self, max_age: float, timeout: float):
+        """Như latest_frame nhưng chờ tối đa timeout giây cho frame mới (luồng vừa khởi động)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._fresh_frame(max_age) is not None, timeout=max(0.0, timeout))
+            frame = self._fresh_frame(max_age)
+            return None if frame is None else frame.copy()
+
+    def subscribe(self):
+        """Generator trả về chunk MJPEG cho một người xem."""
+        with self._cond:
+            self._subscribers += 1
+            self._ensure_running()
+            last_seq = self._seq
+        try:
+            while True:
+                with self._cond:
+                    if not self._cond.wait_for(lambda: self._seq > last_seq, timeout=10):
+                        continue
+                    last_seq, chunk = self._frames[-1]
+                yield chunk
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+                self._last_unsubscribe = time.monotonic()
+
+
+_streams: Dict[str, CameraStream] = {}
+_streams_lock = threading.Lock()
+
+
+def get_camera_stream(rtsp_url: str, placeholder_path: str) -> CameraStream:
+    """Lấy (hoặc tạo) luồng đọc dùng chung cho một camera."""
+    with _streams_lock:
+        stream = _streams.get(rtsp_url)
+        if stream is None:
+            stream = CameraStream(rtsp_url, placeholder_path)
+            _streams[rtsp_url] = stream
+        return stream
+
+
+def start_gate_cameras(app) -> None:
+    """
+    Vẽ sẵn frame offline cho camera cổng vào/ra và giữ sẵn luồng đọc
+    để snapshot không phải chờ bắt tay RTSP.
+    """
+    prepare_offline_frames({app.config["RTSP_URL_IN"]: "CONG VAO", app.config["RTSP_URL_OUT"]: "CONG RA"})
+    if app.config.get("CAMERA_TEST_MODE", True) or not app.config.get("CAMERA_WARM_CAPTURE", True):
+        return
+    placeholder_path = os.path.join(app.static_folder, "placeholder.jpg")
+    for key in ("RTSP_URL_IN", "RTSP_URL_OUT"):
+        get_camera_stream(app.config[key], placeholder_path).start(keep_alive=True)
+
+
+def generate_frames(rtsp_url: str, placeholder_path: str, is_test_mode: bool):
+    """
+    Trả về stream MJPEG.
+    Đã loại bỏ current_app để tránh lỗi Working outside of application context.
+    Tham số được truyền trực tiếp từ bên ngoài vào.
+    """
+    if is_test_mode:
+        while True:
+            chunk = _placeholder_chunk(placeholder_path)
+            if chunk:
+                yield chunk
+            time.sleep(1)
+
+    yield from get_camera_stream(rtsp_url, placeholder_path).subscribe()
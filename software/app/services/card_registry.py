@@ -0,0 +1,94 @@
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+from flask import current_app
+
+CARD_VERSION_KEY = "cards_version"
+
+
+class CardEntry:
+    """Thông tin thẻ cần cho luồng quẹt thẻ; hạn dùng lấy sẵn dạng giây epoch (cột expiry_ts)."""
+
+    __slots__ = ("card_id", "holder_name", "license_plate", "ticket_type", "status", "expiry_date", "expiry_ts")
+
+    def __init__(self, row: sqlite3.Row):
+        self.card_id = row["card_id"]
+        self.holder_name = row["holder_name"]
+        self.license_plate = row["license_plate"]
+        self.ticket_type = row["ticket_type"]
+        self.status = row["status"]
+        self.expiry_date = row["expiry_date"]
+        self.expiry_ts = row["expiry_ts"]
+
+
+class CardRegistry:
+    """
+    Cache thẻ trong tiến trình. Mỗi lần tra cứu chỉ đọc bộ đếm cards_version trong schema_meta;
+    khi tiến trình khác ghi thẻ (bộ đếm tăng), toàn bộ cache được làm mới.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Optional[CardEntry]] = {}
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read_version(conn) -> Optional[int]:
+        try:
+            row = conn.execute("SELECT value FROM schema_meta WHERE key = ?", (CARD_VERSION_KEY,)).fetchone()
+        except sqlite3.OperationalError:
+            # DB chưa chạy setup_db mới: không có bộ đếm thì không cache.
+            return None
+        return int(row["value"]) if row else 0
+
+    def get(self, conn, card_id: str) -> Optional[CardEntry]:
+        """Trả về CardEntry (hoặc None nếu thẻ không tồn tại)."""
+        version = self._read_version(conn)
+        if version is None:
+            return self._load(conn, card_id)
+
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            if card_id in self._entries:
+                return self._entries[card_id]
+
+        entry = self._load(conn, card_id)
+        with self._lock:
+            if self._version == version:
+                self._entries[card_id] = entry
+        return entry
+
+    @staticmethod
+    def _load(conn, card_id: str) -> Optional[CardEntry]:
+        row = conn.execute(
+            "SELECT card_id, holder_name, license_plate, ticket_type, status, expiry_date, expiry_ts FROM cards WHERE card_id = ?",
+            (card_id,),
+        ).fetchone()
+        return CardEntry(row) if row else None
+
+    def invalidate(self, conn, *card_ids: str) -> None:
+        """
+        Tăng cards_version trong cùng transaction với thao tác ghi thẻ (gọi trước commit)
+        và xóa các thẻ liên quan khỏi cache của tiến trình hiện tại.
+        """
+        try:
+            conn.execute(
+                "INSERT INTO schema_meta (key, value) VALUES (?, '1') "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+                (CARD_VERSION_KEY,),
+            )
+        except sqlite3.OperationalError as exc:
+            current_app.logger.warning("Không thể tăng cards_version: %s", exc)
+        with self._lock:
+            for card_id in card_ids:
+                self._entries.pop(card_id, None)
+
+
+def get_card_registry() -> CardRegistry:
+    registry = current_app.extensions.get("card_registry")
+    if registry is None:
+        registry = current_app.extensions.setdefault("card_registry", CardRegistry())
+    return registry
@@ -0,0 +1,44 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+from flask import current_app
+
+
+class CountCache:
+    """
+    Cache kết quả COUNT(*) cho các trang danh sách, hết hạn sau `ttl` giây.
+    Tổng số chỉ để hiển thị nên chấp nhận lệch một chút thay vì quét lại bảng mỗi lần chuyển trang.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, conn, sql: str, params: Tuple = ()) -> int:
+        key = (sql, tuple(params))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached and now - cached[0] < self.ttl:
+                self._entries.move_to_end(key)
+                return cached[1]
+        value = conn.execute(sql, params).fetchone()[0] or 0
+        with self._lock:
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+
+def get_count_cache() -> CountCache:
+    cache = current_app.extensions.get("count_cache")
+    if cache is None:
+        cache = current_app.extensions.setdefault(
+            "count_cache", CountCache(ttl=current_app.config.get("PAGINATION_COUNT_TTL", 60.0))
+        )
+    return cache
@@ -0,0 +1,133 @@
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Mapping, Optional, Tuple
+
+from flask import current_app
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket theo khóa (danh tính thiết bị đã xác thực): mỗi khóa có tối đa `burst` lượt, hồi `rate` lượt mỗi giây.
+    Chỉ giữ `max_keys` khóa gần nhất để thiết bị giả mạo hàng loạt không làm phình bộ nhớ.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 1024):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key: str) -> Tuple[bool, float]:
+        """Lấy một lượt cho `key`; trả về (được phép, số giây nên chờ trước khi thử lại)."""
+        if self.rate <= 0:
+            return True, 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1.0 - tokens) / self.rate
+
+
+class DeviceAdmission:
+    """
+    Cửa vào của các API thiết bị (quẹt thẻ, hỏi trạng thái): xác thực token rồi giới hạn tần suất theo danh tính
+    đã xác thực, hoàn toàn trong bộ nhớ nên request bị từ chối không chạm tới DB.
+    Bucket của thiết bị có token riêng tính theo device_id; thiết bị dùng token chung tính theo địa chỉ IP (device_id
+    tự khai khi đó không đáng tin); lần xác thực sai tính vào bucket riêng theo IP, không đụng tới bucket của thiết bị thật.
+    Thiết bị có trong DEVICE_TOKENS phải dùng token riêng; token chung DEVICE_SECRET_TOKEN chỉ còn cho firmware cũ
+    khi DEVICE_ALLOW_SHARED_TOKEN bật.
+    """
+
+    def __init__(
+        self,
+        device_tokens: Mapping[str, str],
+        shared_token: Optional[str],
+        limiters: Dict[str, TokenBucketLimiter],
+    ):
+        self.device_tokens = dict(device_tokens)
+        self.shared_token = shared_token
+        self.limiters = limiters
+        self._counters: Dict[str, Dict[str, int]] = {kind: {"allowed": 0, "rate_limited": 0, "unauthorized": 0} for kind in limiters}
+        self._lock = threading.Lock()
+
+    def _count(self, kind: str, outcome: str) -> None:
+        with self._lock:
+            self._counters[kind][outcome] += 1
+
+    def _authenticate(self, device_id: Optional[str], token: Optional[str], require_token: bool) -> Optional[str]:
+        """Trả về "device" (token riêng đúng), "shared" (token chung, hoặc không token khi được phép) hoặc None."""
+        expected = self.device_tokens.get(device_id) if device_id else None
+        if expected is not None:
+            return "device" if token is not None and hmac.compare_digest(str(token), expected) else None
+        if not self.shared_token:
+            return None
+        if token is None:
+            return None if require_token else "shared"
+        return "shared" if hmac.compare_digest(str(token), self.shared_token) else None
+
+    def admit(
+        self, kind: str, device_id: Optional[str], token: Optional[str], remote_addr: str, require_token: bool = True
+    ) -> Tuple[Optional[str], Optional[str], float]:
+        """
+        Trả về (mã thiết bị, lỗi, retry_after). Lỗi là "rate_limited" hoặc "unauthorized"; mã thiết bị là
+        device_id do thiết bị gửi, hoặc địa chỉ IP với firmware cũ.
+        """
+        device = str(device_id) if device_id else remote_addr
+        verified = self._authenticate(device_id and str(device_id), token, require_token)
+        if verified is None:
+            allowed, retry_after = self.limiters[kind].allow(f"unauthorized:{remote_addr}")
+            if not allowed:
+                self._count(kind, "rate_limited")
+                return device, "rate_limited", retry_after
+            self._count(kind, "unauthorized")
+            return device, "unauthorized", 0.0
+        allowed, retry_after = self.limiters[kind].allow(device if verified == "device" else f"ip:{remote_addr}")
+        if not allowed:
+            self._count(kind, "rate_limited")
+            return device, "rate_limited", retry_after
+        self._count(kind, "allowed")
+        return device, None, 0.0
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {kind: dict(counters) for kind, counters in self._counters.items()}
+
+
+def parse_device_tokens(raw: Optional[str]) -> Dict[str, str]:
+    """Đọc DEVICE_TOKENS dạng "device_id=token,device_id=token" (device_id có thể là địa chỉ MAC)."""
+    tokens = {}
+    for item in (raw or "").split(","):
+        device_id, sep, token = item.strip().partition("=")
+        if sep and device_id.strip() and token.strip():
+            tokens[device_id.strip()] = token.strip()
+    return tokens
+
+
+def get_device_admission() -> DeviceAdmission:
+    admission = current_app.extensions.get("device_admission")
+    if admission is None:
+        config = current_app.config
+        admission = current_app.extensions.setdefault(
+            "device_admission",
+            DeviceAdmission(
+                parse_device_tokens(config.get("DEVICE_TOKENS")),
+                config["DEVICE_SECRET_TOKEN"] if config.get("DEVICE_ALLOW_SHARED_TOKEN", True) else None,
+                {
+                    "scan": TokenBucketLimiter(config.get("DEVICE_SCAN_RATE", 0.5), config.get("DEVICE_SCAN_BURST", 5)),
+                    "status": TokenBucketLimiter(
+                        config.get("DEVICE_STATUS_RATE", 2.0), config.get("DEVICE_STATUS_BURST", 10)
+                    ),
+                },
+            ),
+        )
+    return admission
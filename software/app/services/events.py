@@ -0,0 +1,67 @@
+import json
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from flask import current_app
+
+
+def build_pending_event(row) -> Dict[str, object]:
+    """Chuyển một dòng pending_actions (Row hoặc dict) thành payload SSE."""
+    return {
+        "id": row["id"],
+        "card_id": row["card_id"],
+        "status": row["status"],
+        "action_type": row["action_type"],
+        "created_at": row["created_at"],
+        "gate_id": row["gate_id"],
+        "lane": row["lane"],
+    }
+
+
+def format_sse(event_id: int, event_type: str, payload: Dict[str, object]) -> str:
+    data = json.dumps(payload, ensure_ascii=False)
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+
+class EventBroadcaster:
+    """
+    Bộ phát sự kiện trong tiến trình cho kênh SSE của bảo vệ.
+    Giữ một ring buffer các sự kiện gần nhất (id = id của pending_actions) để client nối lại theo cursor.
+    """
+
+    def __init__(self, buffer_size: int = 256):
+        self._events: Deque[Tuple[int, Dict[str, object]]] = deque(maxlen=buffer_size)
+        self._latest_id = 0
+        self._cond = threading.Condition()
+
+    @property
+    def latest_id(self) -> int:
+        with self._cond:
+            return self._latest_id
+
+    def publish(self, event_id: int, payload: Dict[str, object]) -> None:
+        with self._cond:
+            self._events.append((event_id, payload))
+            self._latest_id = max(self._latest_id, event_id)
+            self._cond.notify_all()
+
+    def wait_since(self, last_id: int, timeout: float) -> List[Tuple[int, Dict[str, object]]]:
+        """Chờ tới khi có sự kiện id > last_id (hoặc hết timeout), trả về các sự kiện đó theo thứ tự."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._latest_id > last_id, timeout=timeout)
+            return [event for event in self._events if event[0] > last_id]
+
+
+def get_event_broadcaster() -> EventBroadcaster:
+    broadcaster = current_app.extensions.get("event_broadcaster")
+    if broadcaster is None:
+        broadcaster = current_app.extensions.setdefault(
+            "event_broadcaster", EventBroadcaster(current_app.config.get("SSE_BUFFER_SIZE", 256))
+        )
+    return broadcaster
+
+
+def publish_pending_action(event_id: int, row: Dict[str, object], broadcaster: Optional[EventBroadcaster] = None) -> None:
+    """Đẩy yêu cầu mới (entry/exit/alert) tới các màn hình bảo vệ đang kết nối."""
+    (broadcaster or get_event_broadcaster()).publish(event_id, build_pending_event(dict(row, id=event_id)))
@@ -0,0 +1,78 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict
+
+from flask import Flask
+
+from app.database import checkpoint_wal, pooled_connection
+from app.services.rollups import refresh_recent_rollups
+from app.utils import to_epoch
+
+logger = logging.getLogger(__name__)
+
+# Các trạng thái pending_actions còn chờ bảo vệ xử lý; quá PENDING_ACTION_TTL thì bị xóa.
+OPEN_ACTION_STATUSES = ("pending", "alert_unregistered", "alert_lost")
+
+
+def pending_action_cutoff(app: Flask) -> int:
+    """Mốc giây epoch (cột created_ts) mà yêu cầu tạo trước đó được coi là hết hạn."""
+    return to_epoch(datetime.now() - timedelta(seconds=app.config.get("PENDING_ACTION_TTL", 120)))
+
+
+def expire_pending_actions(app: Flask) -> Dict[str, int]:
+    cutoff = pending_action_cutoff(app)
+    placeholders = ", ".join("?" for _ in OPEN_ACTION_STATUSES)
+    with pooled_connection(app) as conn:
+        cursor = conn.execute(
+            f"DELETE FROM pending_actions WHERE status IN ({placeholders}) AND created_ts < ?",
+            (*OPEN_ACTION_STATUSES, cutoff),
+        )
+        conn.commit()
+    return {"deleted": cursor.rowcount}
+
+
+def prune_action_queue(app: Flask) -> Dict[str, int]:
+    """Dọn hàng đợi trong bộ nhớ của tiến trình này (yêu cầu quá hạn, lượt quẹt đã hết cửa sổ chống trùng)."""
+    queue = app.extensions.get("action_queue")
+    return {"dropped_from_memory": queue.expire(pending_action_cutoff(app)) if queue is not None else 0}
+
+
+def sweep_expired_cards(app: Flask) -> Dict[str, int]:
+    """
+    Quét thẻ tháng đã hết hạn. Trạng thái hiển thị được view cards_display tính sẵn nên không cần cập nhật thẻ;
+    job ghi log các thẻ vừa hết hạn trong chu kỳ vừa qua để quản lý liên hệ gia hạn.
+    """
+    now = datetime.now()
+    now_ts = to_epoch(now)
+    window_start = to_epoch(now - timedelta(seconds=app.config.get("CARD_SWEEP_INTERVAL", 3600)))
+    with pooled_connection(app) as conn:
+        expired_total = conn.execute(
+            "SELECT COUNT(*) FROM cards WHERE ticket_type = 'monthly' AND expiry_ts < ?", (now_ts,)
+        ).fetchone()[0]
+        newly_expired = [
+            row["card_id"]
+            for row in conn.execute(
+                "SELECT card_id FROM cards WHERE ticket_type = 'monthly' AND expiry_ts >= ? AND expiry_ts < ?",
+                (window_start, now_ts),
+            ).fetchall()
+        ]
+    if newly_expired:
+        logger.info("Thẻ tháng vừa hết hạn: %s", ", ".join(newly_expired))
+    return {"expired_total": expired_total, "newly_expired": len(newly_expired)}
+
+
+def refresh_rollups(app: Flask) -> Dict[str, object]:
+    days = app.config.get("ROLLUP_REFRESH_DAYS", 1)
+    since = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d 00:00:00")
+    with pooled_connection(app) as conn:
+        changed = refresh_recent_rollups(conn, since)
+        conn.commit()
+    return {"since": since, "changed": changed}
+
+
+def checkpoint_wal_job(app: Flask) -> Dict[str, object]:
+    mode = app.config.get("SQLITE_CHECKPOINT_MODE", "PASSIVE")
+    with pooled_connection(app) as conn:
+        result = checkpoint_wal(conn, mode)
+    busy, log_frames, checkpointed = result if result else (None, None, None)
+    return {"mode": mode, "busy": busy, "log_frames": log_frames, "checkpointed_frames": checkpointed}
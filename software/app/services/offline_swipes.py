@@ -0,0 +1,131 @@
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from app.services.rollups import record_batch
+from app.utils import to_epoch
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Đồng hồ thiết bị được phép nhanh hơn server chừng này giây.
+CLOCK_SKEW_SECONDS = 120
+
+
+def _placeholders(values) -> str:
+    return ", ".join("?" for _ in values)
+
+
+def ingest_swipes(
+    conn, device: str, swipes: List[object], registry, settings, max_age_seconds: float
+) -> List[Dict[str, object]]:
+    """
+    Ghi các lượt quẹt thẻ thiết bị lưu tạm khi mất mạng ({"card_id", "ts": giây epoch}) thành giao dịch vào/ra,
+    theo thứ tự thời gian quẹt. Bảo vệ đã cho xe qua thủ công lúc mất mạng nên không tạo yêu cầu chờ duyệt.
+    Giao dịch mới và giờ ra được ghi bằng executemany trong transaction của bên gọi (bên gọi commit).
+    Trả về kết quả theo đúng thứ tự gửi lên: entry_recorded, exit_recorded, duplicate, unknown_card,
+    lost_card, conflict, too_old hoặc invalid.
+    """
+    results: List[Dict[str, object]] = []
+    valid = []
+    now = time.time()
+    for index, swipe in enumerate(swipes):
+        result: Dict[str, object] = {"index": index}
+        results.append(result)
+        try:
+            card_id = str(swipe["card_id"]).strip()
+            ts = int(swipe["ts"])
+        except (KeyError, TypeError, ValueError):
+            result["status"] = "invalid"
+            continue
+        if isinstance(swipe, dict) and swipe.get("swipe_id") is not None:
+            result["swipe_id"] = swipe["swipe_id"]
+        if not card_id or ts > now + CLOCK_SKEW_SECONDS:
+            result["status"] = "invalid"
+        elif now - ts > max_age_seconds:
+            result["status"] = "too_old"
+        else:
+            moment = datetime.fromtimestamp(ts)
+            valid.append((to_epoch(moment), index, card_id, moment.strftime(TIME_FORMAT)))
+    if not valid:
+        return results
+
+    cards = {card_id: registry.get(conn, card_id) for _, _, card_id, _ in valid}
+    card_ids = [card_id for card_id, card in cards.items() if card is not None]
+    open_transactions: Dict[str, Dict[str, object]] = {}
+    seen_times: Dict[str, set] = {card_id: set() for card_id in card_ids}
+    if card_ids:
+        for row in conn.execute(
+            f"SELECT id, card_id, entry_time, entry_ts FROM transactions "
+            f"WHERE card_id IN ({_placeholders(card_ids)}) AND exit_time IS NULL",
+            card_ids,
+        ).fetchall():
+            open_transactions[row["card_id"]] = {"id": row["id"], "entry_ts": row["entry_ts"]}
+            seen_times[row["card_id"]].add(row["entry_time"])
+        # Lượt đã đồng bộ ở lần gửi trước (thiết bị gửi lại cả lô) được nhận ra qua giờ vào/ra trùng khớp.
+        for row in conn.execute(
+            f"SELECT card_id, entry_time, exit_time FROM transactions "
+            f"WHERE exit_ts >= ? AND card_id IN ({_placeholders(card_ids)})",
+            (min(epoch for epoch, _, _, _ in valid), *card_ids),
+        ).fetchall():
+            seen_times[row["card_id"]].update((row["entry_time"], row["exit_time"]))
+
+    security_user = f"offline:{device}"
+    new_rows: List[Dict[str, object]] = []
+    closed: List[tuple] = []
+    entry_times: List[str] = []
+    exits: List[tuple] = []
+    for epoch, index, card_id, moment in sorted(valid):
+        result = results[index]
+        card = cards[card_id]
+        if card is None:
+            result["status"] = "unknown_card"
+            continue
+        if card.status == "lost":
+            result["status"] = "lost_card"
+            continue
+        if moment in seen_times[card_id]:
+            result["status"] = "duplicate"
+            continue
+
+        current = open_transactions.get(card_id)
+        if current is None:
+            row = {
+                "card_id": card_id,
+                "license_plate": card.license_plate,
+                "entry_time": moment,
+                "entry_ts": epoch,
+                "exit_time": None,
+                "fee": None,
+            }
+            new_rows.append(row)
+            open_transactions[card_id] = row
+            entry_times.append(moment)
+            result["status"] = "entry_recorded"
+        elif current["entry_ts"] > epoch:
+            result["status"] = "conflict"
+            continue
+        else:
+            fee = settings.parking_fee(card, current["entry_ts"], epoch, conn)
+            if "id" in current:
+                closed.append((moment, fee, security_user, current["id"]))
+            else:
+                current.update(exit_time=moment, fee=fee)
+            del open_transactions[card_id]
+            exits.append((moment, fee))
+            result["status"] = "exit_recorded"
+            result["fee"] = fee
+        seen_times[card_id].add(moment)
+
+    conn.executemany(
+        """INSERT INTO transactions (card_id, license_plate, entry_time, exit_time, fee, security_user)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        [
+            (row["card_id"], row["license_plate"], row["entry_time"], row["exit_time"], row["fee"], security_user)
+            for row in new_rows
+        ],
+    )
+    conn.executemany(
+        "UPDATE transactions SET exit_time = ?, fee = ?, security_user = ? WHERE id = ? AND exit_time IS NULL",
+        closed,
+    )
+    record_batch(conn, entry_times, exits)
+    return results
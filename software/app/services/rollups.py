@@ -0,0 +1,146 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Bộ đếm trong schema_meta cho cache thống kê: stats_version tăng sau mỗi lượt ghi vào/ra/đóng tiền,
+# stats_epoch tăng khi tính lại toàn bộ (backfill) hoặc khi ghi vào ngày đã qua, để bỏ cả các ngày đã chốt.
+STATS_VERSION_KEY = "stats_version"
+STATS_EPOCH_KEY = "stats_epoch"
+
+# Bảng tổng hợp cho trang thống kê: (tên bảng, cột khóa, số ký tự đầu của "YYYY-MM-DD HH:MM:SS" làm khóa).
+TIME_ROLLUPS = (
+    ("daily_stats", "day", 10),
+    ("hourly_stats", "hour", 13),
+)
+
+
+def _increment(conn, key: str) -> None:
+    conn.execute(
+        "INSERT INTO schema_meta (key, value) VALUES (?, '1') "
+        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+        (key,),
+    )
+
+
+def _upsert_sql(table: str, key: str) -> str:
+    return f"""INSERT INTO {table} ({key}, revenue, entries, exits) VALUES (?, ?, ?, ?)
+               ON CONFLICT({key}) DO UPDATE SET
+                   revenue = revenue + excluded.revenue,
+                   entries = entries + excluded.entries,
+                   exits = exits + excluded.exits"""
+
+
+def _bump(conn, moment: str, revenue: int = 0, entries: int = 0, exits: int = 0) -> None:
+    for table, key, length in TIME_ROLLUPS:
+        conn.execute(_upsert_sql(table, key), (moment[:length], revenue, entries, exits))
+    _increment(conn, STATS_VERSION_KEY)
+
+
+def record_entry(conn, entry_time: str) -> None:
+    """Cộng một lượt vào; gọi trong cùng transaction với INSERT giao dịch (trước commit)."""
+    _bump(conn, entry_time, entries=1)
+
+
+def record_exit(conn, exit_time: str, fee: Optional[int]) -> None:
+    """Cộng một lượt ra và doanh thu; gọi trong cùng transaction với UPDATE giờ ra."""
+    _bump(conn, exit_time, revenue=int(fee or 0), exits=1)
+
+
+def record_batch(conn, entry_times: Sequence[str], exits: Sequence[Tuple[str, Optional[int]]]) -> None:
+    """
+    Cộng nhiều lượt vào (giờ vào) và ra ((giờ ra, phí)) một lần, gộp theo bucket rồi executemany;
+    dùng khi đồng bộ lượt quẹt offline, gọi trước commit. Lượt quẹt của ngày đã qua làm đổi số liệu đã chốt
+    nên tăng cả stats_epoch.
+    """
+    if not entry_times and not exits:
+        return
+    for table, key, length in TIME_ROLLUPS:
+        totals: Dict[str, List[int]] = {}
+        for moment in entry_times:
+            totals.setdefault(moment[:length], [0, 0, 0])[1] += 1
+        for moment, fee in exits:
+            bucket = totals.setdefault(moment[:length], [0, 0, 0])
+            bucket[0] += int(fee or 0)
+            bucket[2] += 1
+        conn.executemany(_upsert_sql(table, key), [(bucket, *values) for bucket, values in totals.items()])
+    _increment(conn, STATS_VERSION_KEY)
+    today = datetime.now().strftime("%Y-%m-%d")
+    if any(moment[:10] < today for moment in (*entry_times, *(moment for moment, _ in exits))):
+        _increment(conn, STATS_EPOCH_KEY)
+
+
+def record_monthly_payment(conn, month: str, amount: int) -> None:
+    conn.execute(
+        """INSERT INTO monthly_payment_stats (month, revenue, payments) VALUES (?, ?, 1)
+           ON CONFLICT(month) DO UPDATE SET revenue = revenue + excluded.revenue, payments = payments + 1""",
+        (month, amount),
+    )
+    _increment(conn, STATS_VERSION_KEY)
+
+
+def _recompute(conn, since: Optional[str]) -> None:
+    """Xóa rồi tính lại các bucket từ mốc `since` ("YYYY-MM-DD HH:MM:SS"; None = toàn bộ)."""
+    if since is None:
+        params: Dict[str, str] = {}
+        entry_filter, exit_filter, month_filter = "", "WHERE exit_time IS NOT NULL", ""
+    else:
+        params = {"since": since, "month": since[:7]}
+        entry_filter = "WHERE entry_ts >= CAST(strftime('%s', :since) AS INTEGER)"
+        exit_filter = "WHERE exit_ts >= CAST(strftime('%s', :since) AS INTEGER)"
+        month_filter = "WHERE month >= :month"
+
+    for table, key, length in TIME_ROLLUPS:
+        if since is None:
+            conn.execute(f"DELETE FROM {table}")
+        else:
+            conn.execute(f"DELETE FROM {table} WHERE {key} >= ?", (since[:length],))
+        conn.execute(
+            f"""INSERT INTO {table} ({key}, revenue, entries, exits)
+                SELECT bucket, SUM(revenue), SUM(entries), SUM(exits) FROM (
+                    SELECT substr(entry_time, 1, {length}) AS bucket, 0 AS revenue, 1 AS entries, 0 AS exits
+                    FROM transactions {entry_filter}
+                    UNION ALL
+                    SELECT substr(exit_time, 1, {length}), IFNULL(fee, 0), 0, 1
+                    FROM transactions {exit_filter}
+                )
+                GROUP BY bucket""",
+            params,
+        )
+    conn.execute(f"DELETE FROM monthly_payment_stats {month_filter}", params)
+    conn.execute(
+        f"""INSERT INTO monthly_payment_stats (month, revenue, payments)
+            SELECT month, SUM(amount), COUNT(*) FROM monthly_payments {month_filter}
+            GROUP BY month""",
+        params,
+    )
+
+
+def rebuild_rollups(conn) -> Dict[str, int]:
+    """Tính lại toàn bộ bảng tổng hợp từ transactions/monthly_payments (backfill). Bên gọi tự commit."""
+    _recompute(conn, None)
+    counts = {}
+    for table in ("daily_stats", "hourly_stats", "monthly_payment_stats"):
+        counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    _increment(conn, STATS_EPOCH_KEY)
+    return counts
+
+
+def refresh_recent_rollups(conn, since: str) -> bool:
+    """
+    Đối soát các bucket từ `since` (đầu ngày) trở đi với dữ liệu gốc, phòng khi có ghi ngoài luồng cổng
+    (sửa tay, script). Trả về True nếu có thay đổi; khi đó tăng stats_epoch để cache thống kê bỏ số liệu cũ.
+    Bên gọi tự commit.
+    """
+
+    def snapshot():
+        return [
+            conn.execute(f"SELECT * FROM {table} WHERE {key} >= ? ORDER BY {key}", (since[:length],)).fetchall()
+            for table, key, length in TIME_ROLLUPS + (("monthly_payment_stats", "month", 7),)
+        ]
+
+    before = [[tuple(row) for row in rows] for rows in snapshot()]
+    _recompute(conn, since)
+    after = [[tuple(row) for row in rows] for rows in snapshot()]
+    if before == after:
+        return False
+    _increment(conn, STATS_EPOCH_KEY)
+    return True
@@ -0,0 +1,211 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from flask import Flask, current_app
+
+from app.database import get_pool, pooled_connection
+from app.services.maintenance import (
+    checkpoint_wal_job,
+    expire_pending_actions,
+    prune_action_queue,
+    refresh_rollups,
+    sweep_expired_cards,
+)
+from app.services.snapshot_retention import run_retention
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledJob:
+    __slots__ = ("name", "interval", "func", "leased", "next_due", "runs", "last_run_at", "last_result", "last_error")
+
+    def __init__(
+        self, name: str, interval: float, func: Callable[[Flask], Optional[Dict[str, object]]], leased: bool = True
+    ):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.leased = leased
+        self.next_due = 0.0
+        self.runs = 0
+        self.last_run_at: Optional[float] = None
+        self.last_result: Dict[str, object] = {}
+        self.last_error: Optional[str] = None
+
+
+class Scheduler:
+    """
+    Bộ lập lịch chạy việc bảo trì trong một luồng nền.
+    Mỗi job có một dòng lease trong bảng scheduler_jobs: khi chạy nhiều worker, chỉ tiến trình
+    giành được lease (và job đã tới hạn theo last_run_at chung) mới chạy, nên mỗi chu kỳ job chạy đúng một lần.
+    Job đăng ký với leased=False chỉ dọn trạng thái trong bộ nhớ của tiến trình nên chạy ở mọi worker, không cần lease.
+    """
+
+    def __init__(self, app: Flask, tick: float = 5.0, lease_ttl: float = 600.0):
+        self.app = app
+        self.tick = max(0.1, tick)
+        self.lease_ttl = lease_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self._jobs: Dict[str, ScheduledJob] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(
+        self, name: str, interval: float, func: Callable[[Flask], Optional[Dict[str, object]]], leased: bool = True
+    ) -> None:
+        """Đăng ký job; interval <= 0 nghĩa là tắt job."""
+        if interval and interval > 0:
+            self._jobs[name] = ScheduledJob(name, interval, func, leased)
+
+    def start(self) -> None:
+        if self._thread is not None or not self._jobs:
+            return
+        self._thread = threading.Thread(target=self._loop, name="maintenance-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.tick):
+            now = time.time()
+            for job in list(self._jobs.values()):
+                if job.next_due <= now:
+                    self.run_if_due(job.name)
+
+    def run_if_due(self, name: str) -> bool:
+        """Giành lease rồi chạy job nếu tới hạn; trả về True nếu tiến trình này đã chạy job."""
+        job = self._jobs[name]
+        if not job.leased:
+            self._execute(job)
+            return True
+        try:
+            with pooled_connection(self.app) as conn:
+                acquired = self._acquire(conn, job)
+        except Exception as exc:
+            logger.warning("Không thể lấy lease cho job %s: %s", name, exc)
+            job.next_due = time.time() + self.tick
+            return False
+        if acquired:
+            self._execute(job)
+        return acquired
+
+    def _acquire(self, conn, job: ScheduledJob) -> bool:
+        now = time.time()
+        # Đọc trước để các worker không cùng tranh khóa ghi khi job chưa tới hạn.
+        row = conn.execute(
+            "SELECT lease_until, last_run_at FROM scheduler_jobs WHERE job = ?", (job.name,)
+        ).fetchone()
+        if row:
+            due_at = (row["last_run_at"] or 0) + job.interval
+            if row["lease_until"] > now or due_at > now:
+                job.next_due = max(due_at, now + self.tick)
+                return False
+        cursor = conn.execute(
+            """INSERT INTO scheduler_jobs (job, owner, lease_until) VALUES (?, ?, ?)
+               ON CONFLICT(job) DO UPDATE SET owner = excluded.owner, lease_until = excluded.lease_until
+               WHERE scheduler_jobs.lease_until <= ? AND IFNULL(scheduler_jobs.last_run_at, 0) + ? <= ?""",
+            (job.name, self.owner, now + self.lease_ttl, now, job.interval, now),
+        )
+        conn.commit()
+        if cursor.rowcount != 1:
+            job.next_due = now + self.tick
+            return False
+        return True
+
+    def _execute(self, job: ScheduledJob) -> None:
+        started_at = time.time()
+        started = time.monotonic()
+        error = None
+        try:
+            result = job.func(self.app) or {}
+        except Exception as exc:
+            logger.warning("Job %s lỗi: %s", job.name, exc)
+            result = {}
+            error = str(exc)
+        duration = time.monotonic() - started
+
+        with self._lock:
+            job.runs += 1
+            job.last_result = result
+            job.last_error = error
+            job.last_run_at = started_at
+            job.next_due = started_at + job.interval
+        if not job.leased:
+            return
+        try:
+            with pooled_connection(self.app) as conn:
+                conn.execute(
+                    """UPDATE scheduler_jobs
+                       SET lease_until = 0, last_run_at = ?, last_duration = ?, last_error = ?
+                       WHERE job = ? AND owner = ?""",
+                    (started_at, duration, error, job.name, self.owner),
+                )
+                conn.commit()
+        except Exception as exc:
+            logger.warning("Không thể trả lease cho job %s: %s", job.name, exc)
+        logger.debug("Job %s xong trong %.3fs: %s", job.name, duration, result)
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        """
+        Lần chạy gần nhất/thời lượng lấy từ scheduler_jobs (chung cho mọi worker);
+        kết quả chi tiết chỉ có ở tiến trình đã chạy job.
+        """
+        rows = {}
+        try:
+            with pooled_connection(self.app) as conn:
+                rows = {row["job"]: row for row in conn.execute("SELECT * FROM scheduler_jobs").fetchall()}
+        except Exception as exc:
+            logger.warning("Không thể đọc scheduler_jobs: %s", exc)
+
+        stats = {}
+        with self._lock:
+            for name, job in self._jobs.items():
+                row = rows.get(name) if job.leased else None
+                last_run_at = row["last_run_at"] if row else job.last_run_at
+                stats[name] = {
+                    "leased": job.leased,
+                    "interval_seconds": job.interval,
+                    "last_run_at": (
+                        datetime.fromtimestamp(last_run_at).strftime("%Y-%m-%d %H:%M:%S") if last_run_at else None
+                    ),
+                    "last_duration_seconds": round(row["last_duration"], 3) if row and row["last_duration"] else None,
+                    "last_error": row["last_error"] if row else None,
+                    "lease_owner": row["owner"] if row and row["lease_until"] > time.time() else None,
+                    "local_runs": job.runs,
+                    "local_last_result": dict(job.last_result),
+                }
+        return stats
+
+
+def init_scheduler(app: Flask) -> Scheduler:
+    """Đăng ký các job bảo trì theo cấu hình và khởi động luồng lập lịch (nếu bật)."""
+    scheduler = Scheduler(
+        app,
+        tick=app.config.get("SCHEDULER_TICK", 5.0),
+        lease_ttl=app.config.get("SCHEDULER_LEASE_TTL", 600.0),
+    )
+    scheduler.add("expire_pending_actions", app.config.get("PENDING_EXPIRY_INTERVAL", 15), expire_pending_actions)
+    scheduler.add(
+        "prune_action_queue", app.config.get("PENDING_EXPIRY_INTERVAL", 15), prune_action_queue, leased=False
+    )
+    scheduler.add("sweep_expired_cards", app.config.get("CARD_SWEEP_INTERVAL", 3600), sweep_expired_cards)
+    scheduler.add("refresh_rollups", app.config.get("ROLLUP_REFRESH_INTERVAL", 900), refresh_rollups)
+    scheduler.add("snapshot_retention", app.config.get("SNAPSHOT_RETENTION_INTERVAL", 3600), run_retention)
+    if get_pool(app).pragmas.get("journal_mode", "").upper() == "WAL":
+        scheduler.add("wal_checkpoint", app.config.get("SQLITE_CHECKPOINT_INTERVAL", 300), checkpoint_wal_job)
+
+    app.extensions["scheduler"] = scheduler
+    if app.config.get("SCHEDULER_ENABLED", True):
+        scheduler.start()
+    return scheduler
+
+
+def get_scheduler() -> Scheduler:
+    return current_app.extensions["scheduler"]
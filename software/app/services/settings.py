@@ -0,0 +1,94 @@
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import current_app
+
+from app.database import get_db_connection
+
+# Khóa cài đặt -> (kiểu dữ liệu, giá trị mặc định). Thêm biểu phí mới tại đây.
+SETTING_TYPES: Dict[str, Tuple[Callable, object]] = {
+    "fee_per_hour": (int, 5000),
+    "monthly_fee": (int, 0),
+}
+
+
+class SettingsService:
+    """
+    Đọc bảng settings một lần và giữ giá trị đã ép kiểu trong bộ nhớ.
+    Cache hết hạn sau `ttl` giây để các tiến trình khác nhận thay đổi; tiến trình ghi thì vô hiệu hóa ngay.
+    """
+
+    def __init__(self, ttl: float = 30.0):
+        self.ttl = ttl
+        self._values: Optional[Dict[str, object]] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self, conn) -> Dict[str, object]:
+        rows = conn.execute("SELECT key, value FROM settings").fetchall()
+        raw = {row["key"]: row["value"] for row in rows}
+        values = {}
+        for key, (cast, default) in SETTING_TYPES.items():
+            try:
+                values[key] = cast(raw[key]) if key in raw else default
+            except (TypeError, ValueError):
+                current_app.logger.warning("Giá trị cài đặt %s không hợp lệ: %r", key, raw.get(key))
+                values[key] = default
+        return values
+
+    def all(self, conn=None) -> Dict[str, object]:
+        """Trả về toàn bộ cài đặt đã ép kiểu (dùng cache nếu còn hạn)."""
+        with self._lock:
+            if self._values is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._values
+        values = self._load(conn or get_db_connection())
+        with self._lock:
+            self._values = values
+            self._loaded_at = time.monotonic()
+        return values
+
+    def get(self, key: str, conn=None):
+        return self.all(conn)[key]
+
+    def fee_per_hour(self, conn=None) -> int:
+        return self.get("fee_per_hour", conn)
+
+    def monthly_fee(self, conn=None) -> int:
+        return self.get("monthly_fee", conn)
+
+    def parking_fee(self, card, entry_ts: int, exit_ts: int, conn=None) -> int:
+        """
+        Phí gửi xe của một lượt (giây epoch vào/ra): vé ngày, hoặc vé tháng đã hết hạn trước lúc vào,
+        tính theo giờ (làm tròn lên, tối thiểu 1 giờ); vé tháng còn hạn miễn phí.
+        """
+        expiry_ts = card.expiry_ts
+        if not (card.ticket_type == "daily" or (card.ticket_type == "monthly" and expiry_ts is not None and expiry_ts < entry_ts)):
+            return 0
+        hours = max(1, -(-max(0, exit_ts - entry_ts) // 3600))
+        return int(hours * self.fee_per_hour(conn))
+
+    def update(self, conn, values: Dict[str, str]) -> None:
+        """Kiểm tra kiểu và ghi vào bảng settings. Caller commit rồi gọi invalidate()."""
+        for key, raw_value in values.items():
+            if key not in SETTING_TYPES:
+                raise KeyError(f"Cài đặt không được hỗ trợ: {key}")
+            cast, _ = SETTING_TYPES[key]
+            typed_value = cast(raw_value)
+            conn.execute(
+                "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, str(typed_value)),
+            )
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._values = None
+
+
+def get_settings_service() -> SettingsService:
+    service = current_app.extensions.get("settings_service")
+    if service is None:
+        service = current_app.extensions.setdefault(
+            "settings_service", SettingsService(ttl=current_app.config.get("SETTINGS_CACHE_TTL", 30.0))
+        )
+    return service
@@ -0,0 +1,137 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import cv2
+from flask import Flask
+
+from app.database import pooled_connection
+from app.services.snapshot_store import CAS_DIR
+from app.utils import to_epoch
+
+logger = logging.getLogger(__name__)
+
+THUMB_SUFFIX = "_thumb.jpg"
+THUMB_WIDTH = 320
+
+# Cột ảnh -> (cột thời gian dạng chuỗi, cột giây epoch có index dùng để tính tuổi ảnh).
+SNAPSHOT_COLUMNS = {
+    "entry_snapshot": ("entry_time", "entry_ts"),
+    "exit_snapshot": ("exit_time", "exit_ts"),
+}
+
+
+def _absolute_path(snapshot_dir: str, reference: str) -> str:
+    return os.path.join(snapshot_dir, *reference.split("/"))
+
+
+def _make_thumbnail(snapshot_dir: str, frame, reference: str, taken_at: str) -> Optional[str]:
+    """
+    Thu nhỏ frame đã đọc thành *_thumb.jpg trong thư mục ngày YYYY/MM/DD (ảnh bố cục phẳng cũ cũng được chuyển vào);
+    trả về tham chiếu mới hoặc None nếu ghi lỗi.
+    """
+    height, width = frame.shape[:2]
+    if width > THUMB_WIDTH:
+        frame = cv2.resize(frame, (THUMB_WIDTH, max(1, int(height * THUMB_WIDTH / width))), interpolation=cv2.INTER_AREA)
+    day_dir = taken_at[:10].replace("-", "/")
+    stem = os.path.splitext(reference.rsplit("/", 1)[-1])[0]
+    thumb_reference = f"{day_dir}/{stem}{THUMB_SUFFIX}"
+    os.makedirs(os.path.dirname(_absolute_path(snapshot_dir, thumb_reference)), exist_ok=True)
+    if not cv2.imwrite(_absolute_path(snapshot_dir, thumb_reference), frame, [cv2.IMWRITE_JPEG_QUALITY, 70]):
+        return None
+    return thumb_reference
+
+
+def _remove_file(path: str) -> int:
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except OSError:
+        return 0
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def run_retention(app: Flask, now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Một lượt dọn snapshot theo chính sách lưu trữ, xử lý theo lô:
+    - cũ hơn SNAPSHOT_FULL_DAYS: thay ảnh gốc bằng thumbnail;
+    - cũ hơn SNAPSHOT_DELETE_DAYS (0 = không xóa): xóa ảnh và đặt cột về NULL.
+    Blob CAS (placeholder dùng chung) không bị thu nhỏ/xóa, chỉ bỏ tham chiếu.
+    Ảnh gốc đã mất hoặc không đọc được thì đặt cột về NULL ("missing") để lượt sau không quét lại.
+    """
+    now = now or datetime.now()
+    snapshot_dir = app.config["SNAPSHOT_DIR"]
+    full_days = app.config.get("SNAPSHOT_FULL_DAYS", 30)
+    delete_days = app.config.get("SNAPSHOT_DELETE_DAYS", 365)
+    batch_size = app.config.get("SNAPSHOT_RETENTION_BATCH", 200)
+    max_batches = app.config.get("SNAPSHOT_RETENTION_MAX_BATCHES", 50)
+
+    full_cutoff = to_epoch(now - timedelta(days=full_days))
+    delete_cutoff = to_epoch(now - timedelta(days=delete_days)) if delete_days else None
+    stats = {"thumbnailed": 0, "missing": 0, "deleted": 0, "bytes_reclaimed": 0}
+
+    with pooled_connection(app) as conn:
+        for column, (time_column, ts_column) in SNAPSHOT_COLUMNS.items():
+            if delete_cutoff:
+                for _ in range(max_batches):
+                    rows = conn.execute(
+                        f"""SELECT id, {column} AS ref FROM transactions
+                            WHERE {ts_column} < ? AND {column} IS NOT NULL
+                            LIMIT ?""",
+                        (delete_cutoff, batch_size),
+                    ).fetchall()
+                    if not rows:
+                        break
+                    for row in rows:
+                        if not row["ref"].startswith(f"{CAS_DIR}/"):
+                            stats["bytes_reclaimed"] += _remove_file(_absolute_path(snapshot_dir, row["ref"]))
+                    conn.executemany(
+                        f"UPDATE transactions SET {column} = NULL WHERE id = ?", [(row["id"],) for row in rows]
+                    )
+                    conn.commit()
+                    stats["deleted"] += len(rows)
+
+            last_id = 0
+            for _ in range(max_batches):
+                rows = conn.execute(
+                    f"""SELECT id, {column} AS ref, {time_column} AS taken_at FROM transactions
+                        WHERE id > ? AND {ts_column} < ? AND {column} IS NOT NULL
+                          AND {column} NOT LIKE '{CAS_DIR}/%' AND {column} NOT LIKE ? ESCAPE '\\'
+                        ORDER BY id
+                        LIMIT ?""",
+                    (last_id, full_cutoff, "%" + THUMB_SUFFIX.replace("_", "\\_"), batch_size),
+                ).fetchall()
+                if not rows:
+                    break
+                updates = []
+                for row in rows:
+                    source = _absolute_path(snapshot_dir, row["ref"])
+                    frame = cv2.imread(source) if os.path.exists(source) else None
+                    if frame is None:
+                        # Không còn gì để thu nhỏ: bỏ tham chiếu chết (và file hỏng nếu có).
+                        stats["bytes_reclaimed"] += _remove_file(source)
+                        updates.append((None, row["id"]))
+                        stats["missing"] += 1
+                        continue
+                    thumb_reference = _make_thumbnail(snapshot_dir, frame, row["ref"], row["taken_at"])
+                    if thumb_reference is None:
+                        # Lỗi ghi (vd. đầy đĩa): giữ nguyên để lượt sau thử lại.
+                        continue
+                    stats["bytes_reclaimed"] += _remove_file(source) - _file_size(
+                        _absolute_path(snapshot_dir, thumb_reference)
+                    )
+                    updates.append((thumb_reference, row["id"]))
+                    stats["thumbnailed"] += 1
+                conn.executemany(f"UPDATE transactions SET {column} = ? WHERE id = ?", updates)
+                conn.commit()
+                last_id = rows[-1]["id"]
+
+    return stats
@@ -0,0 +1,52 @@
+import hashlib
+import logging
+import os
+import threading
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Thư mục con (trong SNAPSHOT_DIR) chứa blob theo địa chỉ nội dung: cas/ab/cd/<sha256>.jpg
+CAS_DIR = "cas"
+
+# Cache tham chiếu placeholder: path -> (mtime, relpath) để khỏi băm lại mỗi lần chụp.
+_placeholder_refs: Dict[str, Tuple[float, str]] = {}
+_placeholder_lock = threading.Lock()
+
+
+def content_address(data: bytes, extension: str = ".jpg") -> str:
+    """Đường dẫn tương đối (trong SNAPSHOT_DIR) của blob theo SHA-256 nội dung."""
+    digest = hashlib.sha256(data).hexdigest()
+    return "/".join((CAS_DIR, digest[:2], digest[2:4], f"{digest}{extension}"))
+
+
+def store_blob(snapshot_dir: str, data: bytes, extension: str = ".jpg") -> str:
+    """Lưu blob một lần duy nhất (ghi file tạm rồi rename); trả về đường dẫn tương đối."""
+    relpath = content_address(data, extension)
+    destination = os.path.join(snapshot_dir, *relpath.split("/"))
+    if os.path.exists(destination):
+        return relpath
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    tmp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as handle:
+        handle.write(data)
+    os.replace(tmp_path, destination)
+    return relpath
+
+
+def placeholder_reference(snapshot_dir: str, placeholder_path: str) -> str:
+    """
+    Tham chiếu CAS của ảnh placeholder (dùng cho mọi snapshot offline/test).
+    Chỉ đọc + băm lại khi placeholder thay đổi; blob được lưu đúng một lần.
+    """
+    mtime = os.stat(placeholder_path).st_mtime
+    with _placeholder_lock:
+        cached = _placeholder_refs.get(placeholder_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with open(placeholder_path, "rb") as handle:
+        data = handle.read()
+    relpath = store_blob(snapshot_dir, data, os.path.splitext(placeholder_path)[1] or ".jpg")
+    with _placeholder_lock:
+        _placeholder_refs[placeholder_path] = (mtime, relpath)
+    return relpath
@@ -0,0 +1,85 @@
+import logging
+import queue
+import threading
+from typing import Dict
+
+from flask import Flask, current_app
+
+from app.database import pooled_connection
+from app.services.camera import SnapshotJob
+
+logger = logging.getLogger(__name__)
+
+# Cột trạng thái snapshot tương ứng với từng sự kiện của giao dịch.
+STATUS_COLUMNS = {
+    "entry": "entry_snapshot_status",
+    "exit": "exit_snapshot_status",
+}
+
+
+class SnapshotWriter:
+    """
+    Pool luồng ghi snapshot ra đĩa, tách khỏi transaction duyệt xe.
+    Transaction lưu sẵn tên file với trạng thái 'pending'; luồng nền cập nhật 'saved'/'failed' khi ghi xong.
+    """
+
+    def __init__(self, app: Flask, workers: int = 2, queue_size: int = 64, submit_timeout: float = 0.2):
+        self.app = app
+        self.submit_timeout = submit_timeout
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, queue_size))
+        self._lock = threading.Lock()
+        self._counters = {"saved": 0, "failed": 0, "dropped": 0}
+        for index in range(max(1, workers)):
+            threading.Thread(target=self._run, name=f"snapshot-writer-{index}", daemon=True).start()
+
+    def submit(self, job: SnapshotJob, transaction_id: int, event: str) -> bool:
+        """Đưa job vào hàng đợi (gọi sau khi commit). Hàng đợi đầy thì đánh dấu 'dropped'."""
+        column = STATUS_COLUMNS[event]
+        try:
+            self._queue.put((job, transaction_id, column), timeout=self.submit_timeout)
+            return True
+        except queue.Full:
+            logger.warning("Hàng đợi snapshot đầy, bỏ ảnh %s", job.filename)
+            self._finish(transaction_id, column, "dropped")
+            return False
+
+    def _run(self) -> None:
+        while True:
+            job, transaction_id, column = self._queue.get()
+            try:
+                self._finish(transaction_id, column, "saved" if job.write() else "failed")
+            except Exception as exc:
+                logger.warning("Lỗi luồng ghi snapshot: %s", exc)
+            finally:
+                self._queue.task_done()
+
+    def _finish(self, transaction_id: int, column: str, status: str) -> None:
+        with self._lock:
+            self._counters[status] += 1
+        try:
+            with pooled_connection(self.app) as conn:
+                conn.execute(f"UPDATE transactions SET {column} = ? WHERE id = ?", (status, transaction_id))
+                conn.commit()
+        except Exception as exc:
+            logger.warning("Không thể cập nhật %s cho giao dịch %s: %s", column, transaction_id, exc)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counters = dict(self._counters)
+        counters["queue_depth"] = self._queue.qsize()
+        counters["queue_capacity"] = self._queue.maxsize
+        return counters
+
+
+def init_snapshot_writer(app: Flask) -> SnapshotWriter:
+    writer = SnapshotWriter(
+        app,
+        workers=app.config.get("SNAPSHOT_WRITER_THREADS", 2),
+        queue_size=app.config.get("SNAPSHOT_QUEUE_SIZE", 64),
+    )
+    app.extensions["snapshot_writer"] = writer
+    return writer
+
+
+def get_snapshot_writer() -> SnapshotWriter:
+    return current_app.extensions["snapshot_writer"]
@@ -0,0 +1,70 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Tuple
+
+from flask import current_app
+
+from app.services.rollups import STATS_EPOCH_KEY, STATS_VERSION_KEY
+
+
+class StatsCache:
+    """
+    Cache kết quả trang thống kê theo khóa (loại, khoảng thời gian), giới hạn kích thước bằng LRU.
+    Số liệu của ngày/tháng đã qua không đổi nên khóa chỉ gồm stats_epoch (giữ tới khi backfill hoặc đồng bộ
+    lượt quẹt offline của ngày cũ);
+    số liệu "đang chạy" (hôm nay, tháng này, xe trong bãi) thêm stats_version vào khóa
+    nên tự hết hiệu lực sau mỗi lượt xác nhận vào/ra, kể cả khi ghi từ tiến trình khác.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Hashable, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def versions(conn) -> Tuple[int, int]:
+        """Đọc (stats_epoch, stats_version) trong schema_meta bằng một truy vấn theo khóa chính."""
+        try:
+            rows = conn.execute(
+                "SELECT key, value FROM schema_meta WHERE key IN (?, ?)", (STATS_EPOCH_KEY, STATS_VERSION_KEY)
+            ).fetchall()
+        except sqlite3.OperationalError:
+            return 0, 0
+        values = {row["key"]: int(row["value"]) for row in rows}
+        return values.get(STATS_EPOCH_KEY, 0), values.get(STATS_VERSION_KEY, 0)
+
+    def get(self, key: Hashable, loader: Callable[[], object]) -> object:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key]
+            self._misses += 1
+        value = loader()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+
+def get_stats_cache() -> StatsCache:
+    cache = current_app.extensions.get("stats_cache")
+    if cache is None:
+        cache = current_app.extensions.setdefault(
+            "stats_cache", StatsCache(current_app.config.get("STATS_CACHE_SIZE", 512))
+        )
+    return cache
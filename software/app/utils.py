@@ -1,7 +1,9 @@
+import base64
 import calendar
-from datetime import datetime
+import json
+from datetime import datetime, timezone
 from functools import wraps
-from typing import Callable, Optional
+from typing import Callable, List, Optional, Tuple
 
 from flask import redirect, session, url_for
 
@@ -16,11 +18,37 @@ def vn_dt(value, fmt: str = "%d/%m/%Y %H:%M:%S") -> Optional[str]:
         return value
 
 
+def to_epoch(value: datetime) -> int:
+    """
+    Giây epoch của một mốc giờ (giờ địa phương, không timezone) theo cùng quy ước với các cột *_ts
+    trong DB: strftime('%s', ...) coi chuỗi thời gian là UTC nên ở đây cũng vậy.
+    """
+    return calendar.timegm(value.timetuple())
+
+
+def vn_ts(value, fmt: str = "%d/%m/%Y %H:%M:%S") -> Optional[str]:
+    """Định dạng giá trị cột *_ts (giây epoch) sang kiểu Việt Nam, không cần parse chuỗi."""
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value, timezone.utc).strftime(fmt)
+
+
 def escape_like(value: str) -> str:
     """Escape ký tự wildcard để dùng an toàn với LIKE."""
     return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
 
 
+def fts_phrase(value: str, column: Optional[str] = None) -> Optional[str]:
+    """
+    Chuyển chuỗi tìm kiếm thành biểu thức MATCH (cụm từ) cho bảng FTS5 trigram.
+    Trả về None nếu chuỗi ngắn hơn 3 ký tự (trigram không tra được) để bên gọi dùng LIKE.
+    """
+    if len(value) < 3:
+        return None
+    phrase = '"' + value.replace('"', '""') + '"'
+    return f"{column} : {phrase}" if column else phrase
+
+
 def parse_int_param(raw_value, default: int, max_value: Optional[int] = None) -> int:
     """Chuyển chuỗi sang int với giá trị mặc định và giới hạn tối đa."""
     try:
@@ -34,6 +62,26 @@ def parse_int_param(raw_value, default: int, max_value: Optional[int] = None) ->
     return value
 
 
+def encode_cursor(direction: str, values: List) -> str:
+    """Mã hóa cursor phân trang keyset thành token mờ (base64url) dùng trên URL."""
+    raw = json.dumps([direction, values], separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: Optional[str]) -> Optional[Tuple[str, List]]:
+    """Giải mã token cursor; trả về (hướng 'next'/'prev', giá trị khóa) hoặc None nếu không hợp lệ."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        direction, values = json.loads(raw.decode("utf-8"))
+    except (ValueError, TypeError):
+        return None
+    if direction not in ("next", "prev") or not isinstance(values, list):
+        return None
+    return direction, values
+
+
 def add_months(base_date: datetime, months: int) -> datetime:
     """Cộng thêm số tháng, giữ nguyên ngày trong tháng nếu có thể."""
     month = base_date.month - 1 + months
@@ -85,3 +133,4 @@ def role_required(required_role: str) -> Callable:
 def register_template_filters(app):
     """Đăng ký các filter template cần dùng."""
     app.template_filter("vn_dt")(vn_dt)
+    app.template_filter("vn_ts")(vn_ts)
@@ -0,0 +1,24 @@
+import sqlite3
+
+from config import Config
+from app.services.rollups import rebuild_rollups
+
+DATABASE = Config.DATABASE_PATH
+
+
+def backfill_rollups():
+    """Tính lại bảng tổng hợp thống kê (theo ngày/giờ/tháng) từ toàn bộ lịch sử giao dịch."""
+    print(f"Đang kết nối đến database: {DATABASE}")
+    conn = sqlite3.connect(DATABASE)
+    try:
+        counts = rebuild_rollups(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    for table, total in counts.items():
+        print(f"- {table}: {total} dòng")
+    print("--- HOÀN TẤT! Đã tính lại bảng tổng hợp thống kê. ---")
+
+
+if __name__ == '__main__':
+    backfill_rollups()
@@ -0,0 +1,76 @@
+import hashlib
+import os
+import sqlite3
+import sys
+from collections import defaultdict
+from typing import Dict, List
+
+from config import Config
+from app.services.snapshot_store import store_blob
+
+DATABASE = Config.DATABASE_PATH
+SNAPSHOT_DIR = Config.SNAPSHOT_DIR
+BATCH_SIZE = 500
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _group_duplicates(snapshot_dir: str) -> Dict[str, List[str]]:
+    """Nhóm các file ảnh ở cấp gốc SNAPSHOT_DIR (bố cục phẳng cũ) theo nội dung."""
+    groups: Dict[str, List[str]] = defaultdict(list)
+    for entry in os.scandir(snapshot_dir):
+        if entry.is_file() and entry.name.lower().endswith((".jpg", ".jpeg", ".png")):
+            groups[_hash_file(entry.path)].append(entry.name)
+    return {digest: names for digest, names in groups.items() if len(names) > 1}
+
+
+def dedupe_snapshots(dry_run: bool = False):
+    """
+    Gộp các snapshot trùng nội dung (chủ yếu là bản copy placeholder khi camera offline)
+    vào kho theo địa chỉ nội dung, cập nhật tham chiếu trong transactions rồi mới xóa file cũ.
+    """
+    print(f"Đang quét thư mục snapshot: {SNAPSHOT_DIR}")
+    groups = _group_duplicates(SNAPSHOT_DIR)
+    duplicate_files = sum(len(names) for names in groups.values())
+    print(f"Tìm thấy {len(groups)} nhóm ảnh trùng ({duplicate_files} file).")
+    if dry_run or not groups:
+        return
+
+    conn = sqlite3.connect(DATABASE)
+    removed_files = 0
+    reclaimed_bytes = 0
+    try:
+        for names in groups.values():
+            first_path = os.path.join(SNAPSHOT_DIR, names[0])
+            with open(first_path, "rb") as handle:
+                data = handle.read()
+            relpath = store_blob(SNAPSHOT_DIR, data, os.path.splitext(names[0])[1].lower())
+
+            for start in range(0, len(names), BATCH_SIZE):
+                batch = [(relpath, name) for name in names[start:start + BATCH_SIZE]]
+                conn.executemany("UPDATE transactions SET entry_snapshot = ? WHERE entry_snapshot = ?", batch)
+                conn.executemany("UPDATE transactions SET exit_snapshot = ? WHERE exit_snapshot = ?", batch)
+                conn.commit()
+
+            for name in names:
+                path = os.path.join(SNAPSHOT_DIR, name)
+                size = os.path.getsize(path)
+                os.remove(path)
+                removed_files += 1
+                reclaimed_bytes += size
+            # Blob mới thay thế cho các file đã xóa.
+            reclaimed_bytes -= len(data)
+    finally:
+        conn.close()
+
+    print(f"--- HOÀN TẤT! Đã gộp {removed_files} file, giải phóng {reclaimed_bytes / 1024 / 1024:,.1f} MB. ---")
+
+
+if __name__ == '__main__':
+    dedupe_snapshots(dry_run="--dry-run" in sys.argv[1:])
@@ -4,6 +4,7 @@ import sqlite3
 from datetime import datetime, timedelta
 
 from config import Config
+from app.services.rollups import rebuild_rollups
 
 DATABASE = Config.DATABASE_PATH
 
@@ -160,6 +161,16 @@ def create_fake_data():
             total_records += 1
 
     seed_monthly_payments(cursor, monthly_fee)
+    # Dữ liệu giả được chèn thẳng vào bảng nên phải tính lại bảng tổng hợp thống kê.
+    try:
+        rebuild_rollups(conn)
+    except sqlite3.OperationalError:
+        print("Chưa có bảng tổng hợp thống kê, hãy chạy setup_db.py rồi backfill_rollups.py.")
+    # Báo cho cache thẻ của server đang chạy biết bảng cards đã thay đổi.
+    try:
+        cursor.execute("UPDATE schema_meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'cards_version'")
+    except sqlite3.OperationalError:
+        pass
     conn.commit()
     conn.close()
     print(f"--- HOÀN TẤT! Đã thêm {total_records} giao dịch giả với giá {current_fee:,.0f}đ/h. ---")
@@ -1,18 +1,308 @@
 import sqlite3
-from typing import List
+import sys
+from typing import Dict, List, Tuple
 
 from werkzeug.security import generate_password_hash
 
+from app.services.rollups import rebuild_rollups
 from config import Config
 
 DATABASE = Config.DATABASE_PATH
 
+# Bộ index có đánh phiên bản: tăng INDEX_VERSION mỗi khi thay đổi danh sách dưới đây.
+INDEX_VERSION = 6
+INDEXES: List[Tuple[str, str]] = [
+    # Partial index: chỉ chứa xe đang trong bãi, dùng cho device_scan và cars_in_parking.
+    (
+        "idx_transactions_open_card",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_open_card ON transactions(card_id) WHERE exit_time IS NULL",
+    ),
+    ("idx_transactions_entry_ts", "CREATE INDEX IF NOT EXISTS idx_transactions_entry_ts ON transactions(entry_ts)"),
+    ("idx_transactions_exit_ts", "CREATE INDEX IF NOT EXISTS idx_transactions_exit_ts ON transactions(exit_ts)"),
+    (
+        "idx_pending_actions_status_created",
+        "CREATE INDEX IF NOT EXISTS idx_pending_actions_status_created ON pending_actions(status, created_ts)",
+    ),
+    # Thẻ tháng theo hạn dùng: bộ lọc "hết hạn" của admin_dashboard và job dọn thẻ hết hạn.
+    (
+        "idx_cards_type_expiry",
+        "CREATE INDEX IF NOT EXISTS idx_cards_type_expiry ON cards(ticket_type, expiry_ts)",
+    ),
+    ("idx_monthly_payments_paid_ts", "CREATE INDEX IF NOT EXISTS idx_monthly_payments_paid_ts ON monthly_payments(paid_ts)"),
+    # Khóa keyset của admin_dashboard (created_sort DESC, card_id ASC): cột generated nên điều kiện
+    # created_sort <= ? là một lần seek index, không phải quét từ đầu index.
+    (
+        "idx_cards_created_desc",
+        "CREATE INDEX IF NOT EXISTS idx_cards_created_desc ON cards(created_sort DESC, card_id)",
+    ),
+    ("idx_monthly_payments_month", "CREATE INDEX IF NOT EXISTS idx_monthly_payments_month ON monthly_payments(month)"),
+]
+
+# Index của các phiên bản trước, bị xóa khi nâng cấp.
+OBSOLETE_INDEXES: List[str] = [
+    "idx_cards_created_at",
+    "idx_cards_created_key",
+    "idx_cards_created_sort",
+    "idx_cards_expiry_ts",
+    "idx_transactions_entry_time",
+    "idx_transactions_exit_time",
+]
+
+# Cột giây epoch (INTEGER) đi kèm các cột thời gian dạng chuỗi "%Y-%m-%d %H:%M:%S": (bảng, cột epoch, cột nguồn).
+# Là cột generated (VIRTUAL) nên luôn đồng bộ với cột nguồn mà không cần trigger; strftime('%s') coi chuỗi là UTC,
+# phía Python dùng app.utils.to_epoch với cùng quy ước.
+TIMESTAMP_COLUMNS: List[Tuple[str, str, str]] = [
+    ("transactions", "entry_ts", "entry_time"),
+    ("transactions", "exit_ts", "exit_time"),
+    ("pending_actions", "created_ts", "created_at"),
+    ("cards", "expiry_ts", "expiry_date"),
+    ("monthly_payments", "paid_ts", "paid_at"),
+]
+
+# Cột khóa sắp xếp (generated VIRTUAL): (bảng, cột, biểu thức). SQLite chỉ seek được index theo so sánh
+# row-value trên cột thật, không trên index biểu thức như IFNULL(created_at, '').
+SORT_KEY_COLUMNS: List[Tuple[str, str, str]] = [
+    ("cards", "created_sort", "IFNULL(created_at, '')"),
+]
+
+# Tăng ROLLUP_VERSION khi đổi cấu trúc bảng tổng hợp thống kê để setup_db tính lại (backfill).
+ROLLUP_VERSION = 1
+
+# Trạng thái hiển thị của thẻ (lost > expired > status), định nghĩa một lần cho cả bộ lọc và giao diện.
+# 'now', 'localtime' cho giây epoch cùng quy ước với cột expiry_ts. View được tạo lại mỗi lần chạy setup_db.
+CARDS_DISPLAY_VIEW = """
+CREATE VIEW cards_display AS
+SELECT
+    rowid AS card_rowid,
+    card_id, holder_name, license_plate, ticket_type, status, created_at, created_sort, expiry_date, expiry_ts,
+    CASE
+        WHEN status = 'lost' THEN 'lost'
+        WHEN ticket_type = 'monthly' AND expiry_ts < CAST(strftime('%s', 'now', 'localtime') AS INTEGER) THEN 'expired'
+        ELSE COALESCE(NULLIF(status, ''), 'unknown')
+    END AS display_status
+FROM cards
+"""
+
+# Chỉ mục tìm kiếm FTS5 (tokenizer trigram, external content) cho ô tìm kiếm của admin:
+# (bảng FTS, bảng nguồn, cột rowid của bảng nguồn, các cột được đánh chỉ mục).
+# Tăng SEARCH_VERSION khi thay đổi danh sách để setup_db dựng lại chỉ mục.
+SEARCH_VERSION = 1
+SEARCH_TABLES: List[Tuple[str, str, str, Tuple[str, ...]]] = [
+    ("cards_fts", "cards", "rowid", ("card_id", "holder_name", "license_plate")),
+    ("transactions_fts", "transactions", "id", ("card_id", "license_plate", "security_user")),
+]
+
+# Các truy vấn nóng (cổng + báo cáo) không được phép quét toàn bảng.
+HOT_QUERIES: List[Tuple[str, str, tuple]] = [
+    (
+        "device_scan: giao dịch đang mở",
+        "SELECT * FROM transactions WHERE card_id = ? AND exit_time IS NULL",
+        ("CARD",),
+    ),
+    ("device_scan: tra thẻ", "SELECT * FROM cards WHERE card_id = ?", ("CARD",)),
+    ("check_action_status", "SELECT status FROM pending_actions WHERE id = ?", (1,)),
+    (
+        "get_pending_scans: yêu cầu của worker khác",
+        "SELECT * FROM pending_actions WHERE status IN (?, ?, ?) AND created_ts >= ? ORDER BY id LIMIT 20",
+        ("pending", "alert_unregistered", "alert_lost", 946684800),
+    ),
+    (
+        "device_scan_batch: giao dịch đang mở",
+        "SELECT id, card_id, entry_time, entry_ts FROM transactions WHERE card_id IN (?, ?) AND exit_time IS NULL",
+        ("CARD", "CARD2"),
+    ),
+    (
+        "device_scan_batch: lượt đã đồng bộ",
+        "SELECT card_id, entry_time, exit_time FROM transactions WHERE exit_ts >= ? AND card_id IN (?, ?)",
+        (946684800, "CARD", "CARD2"),
+    ),
+    (
+        "scheduler: dọn yêu cầu quá hạn",
+        "DELETE FROM pending_actions WHERE status IN ('pending', 'alert_unregistered', 'alert_lost') AND created_ts < ?",
+        (946684800,),
+    ),
+    ("statistics: số liệu hôm nay", "SELECT revenue, entries FROM daily_stats WHERE day = ?", ("2000-01-01",)),
+    ("statistics: xe trong bãi", "SELECT COUNT(*) FROM transactions WHERE exit_time IS NULL", ()),
+    (
+        "statistics: theo ngày",
+        "SELECT day, revenue, entries FROM daily_stats WHERE day BETWEEN ? AND ?",
+        ("2000-01-01", "2000-01-07"),
+    ),
+    (
+        "statistics: vé tháng",
+        "SELECT month, revenue, payments FROM monthly_payment_stats WHERE month BETWEEN ? AND ?",
+        ("2000-01", "2000-06"),
+    ),
+    (
+        "view_transactions: lọc theo ngày ra",
+        "SELECT * FROM transactions WHERE exit_ts >= ? AND exit_ts < ? ORDER BY id DESC LIMIT 26",
+        (946684800, 947289600),
+    ),
+    (
+        "admin_dashboard: thẻ hết hạn",
+        "SELECT card_id, display_status FROM cards_display WHERE display_status = 'expired' "
+        "AND ticket_type = 'monthly' AND expiry_ts < CAST(strftime('%s', 'now', 'localtime') AS INTEGER) "
+        "ORDER BY created_sort DESC, card_id LIMIT 26",
+        (),
+    ),
+    (
+        "snapshot_retention: ảnh cũ",
+        "SELECT id, entry_snapshot FROM transactions WHERE entry_ts < ? AND entry_snapshot IS NOT NULL LIMIT 200",
+        (946684800,),
+    ),
+    (
+        "admin_dashboard: trang thẻ theo cursor",
+        "SELECT card_id FROM cards_display WHERE created_sort <= ? AND (created_sort < ? OR card_id > ?) "
+        "ORDER BY created_sort DESC, card_id LIMIT 26",
+        ("2000-01-01 00:00:00", "2000-01-01 00:00:00", "CARD"),
+    ),
+    (
+        "admin_dashboard: trang thẻ trước theo cursor",
+        "SELECT card_id FROM cards_display WHERE created_sort >= ? AND (created_sort > ? OR card_id < ?) "
+        "ORDER BY created_sort, card_id DESC LIMIT 26",
+        ("2000-01-01 00:00:00", "2000-01-01 00:00:00", "CARD"),
+    ),
+    (
+        "admin_dashboard: tìm thẻ",
+        "SELECT card_id FROM (SELECT rowid AS match_rowid FROM cards_fts WHERE cards_fts MATCH ?) "
+        "CROSS JOIN cards_display ON card_rowid = match_rowid ORDER BY created_sort DESC, card_id LIMIT 26",
+        ('"555.8"',),
+    ),
+    (
+        "admin_dashboard: tìm thẻ theo cursor",
+        "SELECT card_id FROM (SELECT rowid AS match_rowid FROM cards_fts WHERE cards_fts MATCH ?) "
+        "CROSS JOIN cards_display ON card_rowid = match_rowid "
+        "WHERE created_sort <= ? AND (created_sort < ? OR card_id > ?) ORDER BY created_sort DESC, card_id LIMIT 26",
+        ('"555.8"', "2000-01-01 00:00:00", "2000-01-01 00:00:00", "CARD"),
+    ),
+    (
+        "view_transactions: tìm giao dịch",
+        "SELECT * FROM transactions WHERE id IN (SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH ?) "
+        "ORDER BY id DESC LIMIT 26",
+        ('"555.8"',),
+    ),
+    (
+        "view_transactions: trang theo cursor",
+        "SELECT * FROM transactions WHERE id < ? ORDER BY id DESC LIMIT 26",
+        (1000,),
+    ),
+]
+
+
+# Truy vấn nóng được phép có bước SCAN vì đã xem xét là bị chặn trên hoặc chỉ đọc index phủ: tên -> lý do.
+BOUNDED_SCANS: Dict[str, str] = {
+    "statistics: xe trong bãi": "đếm trên partial index idx_transactions_open_card, chỉ chứa xe đang trong bãi",
+}
+
 
 def _get_columns(cursor: sqlite3.Cursor, table: str) -> List[str]:
-    cursor.execute(f"PRAGMA table_info({table});")
+    # table_xinfo liệt kê cả cột generated (table_info thì không).
+    cursor.execute(f"PRAGMA table_xinfo({table});")
     return [row[1] for row in cursor.fetchall()]
 
 
+def _ensure_timestamp_columns(cursor: sqlite3.Cursor) -> None:
+    """Migration: thêm các cột giây epoch còn thiếu (cột generated, không phải ghi lại dữ liệu cũ)."""
+    for table, ts_column, source_column in TIMESTAMP_COLUMNS:
+        if ts_column in _get_columns(cursor, table):
+            continue
+        cursor.execute(
+            f"ALTER TABLE {table} ADD COLUMN {ts_column} INTEGER "
+            f"GENERATED ALWAYS AS (CAST(strftime('%s', {source_column}) AS INTEGER)) VIRTUAL"
+        )
+        print(f"Đã thêm cột '{ts_column}' vào bảng {table}.")
+
+
+def _ensure_sort_key_columns(cursor: sqlite3.Cursor) -> None:
+    """Migration: thêm các cột khóa sắp xếp còn thiếu (cột generated, không phải ghi lại dữ liệu cũ)."""
+    for table, column, expression in SORT_KEY_COLUMNS:
+        if column in _get_columns(cursor, table):
+            continue
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT GENERATED ALWAYS AS ({expression}) VIRTUAL")
+        print(f"Đã thêm cột '{column}' vào bảng {table}.")
+
+
+def _ensure_indexes(cursor: sqlite3.Cursor) -> None:
+    """Tạo bộ index hiện hành và ghi lại phiên bản vào schema_meta."""
+    for name in OBSOLETE_INDEXES:
+        cursor.execute(f"DROP INDEX IF EXISTS {name}")
+    for _, ddl in INDEXES:
+        cursor.execute(ddl)
+    cursor.execute("SELECT value FROM schema_meta WHERE key = 'index_version'")
+    row = cursor.fetchone()
+    current_version = int(row[0]) if row else 0
+    if current_version != INDEX_VERSION:
+        cursor.execute("ANALYZE;")
+        cursor.execute(
+            "INSERT OR REPLACE INTO schema_meta (key, value) VALUES ('index_version', ?)", (str(INDEX_VERSION),)
+        )
+        print(f"Đã cập nhật bộ index lên phiên bản {INDEX_VERSION}.")
+
+
+def _ensure_search_indexes(cursor: sqlite3.Cursor) -> None:
+    """Tạo bảng FTS5 + trigger đồng bộ; dựng lại toàn bộ chỉ mục khi SEARCH_VERSION thay đổi."""
+    cursor.execute("SELECT value FROM schema_meta WHERE key = 'search_version'")
+    row = cursor.fetchone()
+    rebuild = (int(row[0]) if row else 0) != SEARCH_VERSION
+
+    for fts_table, source, rowid_column, columns in SEARCH_TABLES:
+        column_list = ", ".join(columns)
+        new_values = ", ".join(f"new.{column}" for column in columns)
+        old_values = ", ".join(f"old.{column}" for column in columns)
+        if rebuild:
+            cursor.execute(f"DROP TABLE IF EXISTS {fts_table}")
+            for suffix in ("ai", "ad", "au"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {fts_table}_{suffix}")
+        cursor.execute(
+            f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                {column_list}, content='{source}', content_rowid='{rowid_column}', tokenize='trigram'
+            )"""
+        )
+        cursor.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {source} BEGIN
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.{rowid_column}, {new_values});
+            END"""
+        )
+        cursor.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {source} BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.{rowid_column}, {old_values});
+            END"""
+        )
+        # Chỉ chạy khi cột được tìm kiếm thay đổi (cập nhật giờ ra/phí/snapshot không đụng tới FTS).
+        cursor.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column_list} ON {source} BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.{rowid_column}, {old_values});
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.{rowid_column}, {new_values});
+            END"""
+        )
+        if rebuild:
+            cursor.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+
+    if rebuild:
+        cursor.execute(
+            "INSERT OR REPLACE INTO schema_meta (key, value) VALUES ('search_version', ?)", (str(SEARCH_VERSION),)
+        )
+        print(f"Đã dựng lại chỉ mục tìm kiếm (phiên bản {SEARCH_VERSION}).")
+
+
+def check_query_plans(conn: sqlite3.Connection) -> List[Tuple[str, str]]:
+    """
+    Chạy EXPLAIN QUERY PLAN cho các truy vấn nóng.
+    Trả về danh sách (tên truy vấn, dòng plan) có bước SCAN: "SCAN ... USING INDEX" vẫn là đọc hết index nên
+    cũng bị tính, trừ truy vấn có trong BOUNDED_SCANS. Bước MATCH của FTS5 (SCAN ... VIRTUAL TABLE INDEX n:M...)
+    là tra chỉ mục tìm kiếm, không tính.
+    """
+    offenders = []
+    for name, sql, params in HOT_QUERIES:
+        if name in BOUNDED_SCANS:
+            continue
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall():
+            detail = row[-1]
+            if detail.startswith("SCAN ") and ":M" not in detail.partition(" VIRTUAL TABLE INDEX ")[2]:
+                offenders.append((name, detail))
+    return offenders
+
+
 def setup_database():
     """Hàm này sẽ tạo/cập nhật các bảng và chèn dữ liệu mẫu."""
     try:
@@ -160,6 +450,13 @@ def setup_database():
         except sqlite3.OperationalError:
             pass
 
+        # Trạng thái ghi snapshot nền: 'pending', 'saved', 'failed', 'dropped' (NULL = dữ liệu cũ)
+        transaction_columns = _get_columns(cursor, "transactions")
+        for column in ("entry_snapshot_status", "exit_snapshot_status"):
+            if column not in transaction_columns:
+                cursor.execute(f"ALTER TABLE transactions ADD COLUMN {column} TEXT;")
+                print(f"Đã thêm cột '{column}' vào bảng transactions.")
+
         # --- Bảng đóng tiền vé tháng ---
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS monthly_payments (
@@ -182,6 +479,9 @@ def setup_database():
             status TEXT NOT NULL,            -- 'pending', 'processing', 'approved', 'denied'
             action_type TEXT NOT NULL,      -- 'entry' hoặc 'exit'
             created_at TEXT NOT NULL,
+            gate_id TEXT,                   -- Cổng nơi quẹt thẻ ('default' với thiết bị cũ)
+            lane TEXT,                      -- Làn trong cổng (vd 'in', 'out'), có thể NULL
+            idempotency_key TEXT UNIQUE,    -- "<thiết bị>:<idempotency_key>" do ESP32 gửi, chặn ghi trùng giữa các worker
             
             -- Dữ liệu cho 'exit'
             transaction_id INTEGER,         -- ID của giao dịch gốc
@@ -193,6 +493,73 @@ def setup_database():
         """)
         print("Đã tạo/cập nhật bảng 'pending_actions'.")
 
+        # --- Bảng schema_meta: phiên bản index và các bộ đếm dùng để vô hiệu hóa cache ---
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_meta (
+            key TEXT PRIMARY KEY NOT NULL,
+            value TEXT NOT NULL
+        );
+        """)
+        cursor.execute("INSERT OR IGNORE INTO schema_meta (key, value) VALUES ('cards_version', '0')")
+        print("Đã tạo/cập nhật bảng 'schema_meta'.")
+
+        # --- Lease của bộ lập lịch job bảo trì (mỗi job một dòng, dùng chung giữa các worker) ---
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_jobs (
+            job TEXT PRIMARY KEY NOT NULL,
+            owner TEXT,                          -- tiến trình giữ lease gần nhất
+            lease_until REAL NOT NULL DEFAULT 0, -- giây epoch; 0 = không ai giữ
+            last_run_at REAL,
+            last_duration REAL,
+            last_error TEXT
+        );
+        """)
+        print("Đã tạo/cập nhật bảng 'scheduler_jobs'.")
+
+        # --- Bảng tổng hợp thống kê (cập nhật dần khi bảo vệ xác nhận vào/ra) ---
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT PRIMARY KEY NOT NULL,      -- YYYY-MM-DD
+            revenue INTEGER NOT NULL DEFAULT 0, -- Doanh thu theo giờ ra
+            entries INTEGER NOT NULL DEFAULT 0, -- Lượt vào theo giờ vào
+            exits INTEGER NOT NULL DEFAULT 0
+        );
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS hourly_stats (
+            hour TEXT PRIMARY KEY NOT NULL,     -- YYYY-MM-DD HH
+            revenue INTEGER NOT NULL DEFAULT 0,
+            entries INTEGER NOT NULL DEFAULT 0,
+            exits INTEGER NOT NULL DEFAULT 0
+        );
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS monthly_payment_stats (
+            month TEXT PRIMARY KEY NOT NULL,    -- YYYY-MM
+            revenue INTEGER NOT NULL DEFAULT 0,
+            payments INTEGER NOT NULL DEFAULT 0
+        );
+        """)
+        cursor.execute("SELECT value FROM schema_meta WHERE key = 'rollup_version'")
+        row = cursor.fetchone()
+        if (int(row[0]) if row else 0) != ROLLUP_VERSION:
+            rebuild_rollups(cursor)
+            cursor.execute(
+                "INSERT OR REPLACE INTO schema_meta (key, value) VALUES ('rollup_version', ?)", (str(ROLLUP_VERSION),)
+            )
+            print(f"Đã tính lại bảng tổng hợp thống kê (phiên bản {ROLLUP_VERSION}).")
+        print("Đã tạo/cập nhật bảng tổng hợp thống kê.")
+
+        _ensure_timestamp_columns(cursor)
+        _ensure_sort_key_columns(cursor)
+        cursor.execute("DROP VIEW IF EXISTS cards_display")
+        cursor.execute(CARDS_DISPLAY_VIEW)
+        _ensure_indexes(cursor)
+        print("Đã tạo/cập nhật index.")
+
+        _ensure_search_indexes(cursor)
+        print("Đã tạo/cập nhật chỉ mục tìm kiếm.")
+
         # --- Chèn dữ liệu mẫu ---
         admin_pass = generate_password_hash('123456')
         security_pass = generate_password_hash('123456')
@@ -224,5 +591,46 @@ def setup_database():
     except Exception as e:
         print(f"Đã xảy ra lỗi: {e}")
 
+def schema_only_copy(source: sqlite3.Connection) -> sqlite3.Connection:
+    """
+    DB trong bộ nhớ chỉ có schema (bảng, view, index, trigger, FTS) chép từ DDL của source, không dữ liệu
+    và không sqlite_stat*: query plan khi đó không phụ thuộc vào số liệu ANALYZE của từng máy.
+    """
+    # Bảng phụ do FTS5 tự tạo khi CREATE VIRTUAL TABLE, không chép riêng.
+    shadow_prefixes = tuple(f"{fts_table}_" for fts_table, _, _, _ in SEARCH_TABLES)
+    rows = source.execute(
+        """SELECT type, name, sql FROM sqlite_master
+           WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+           ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'view' THEN 1 WHEN 'index' THEN 2 ELSE 3 END, rowid"""
+    ).fetchall()
+    copy = sqlite3.connect(":memory:")
+    for object_type, name, sql in rows:
+        if object_type == "table" and name.startswith(shadow_prefixes):
+            continue
+        copy.execute(sql)
+    return copy
+
+
+def run_query_plan_check() -> int:
+    """Kiểm tra hồi quy query plan; trả về mã thoát != 0 nếu có truy vấn nóng quét toàn bảng."""
+    source = sqlite3.connect(DATABASE)
+    try:
+        conn = schema_only_copy(source)
+    finally:
+        source.close()
+    try:
+        offenders = check_query_plans(conn)
+    finally:
+        conn.close()
+    if offenders:
+        for name, detail in offenders:
+            print(f"[FAIL] {name}: {detail}")
+        return 1
+    print(f"[OK] {len(HOT_QUERIES)} truy vấn nóng đều dùng index ({len(BOUNDED_SCANS)} truy vấn quét có giới hạn).")
+    return 0
+
+
 if __name__ == '__main__':
     setup_database()
+    if "--check-plans" in sys.argv[1:]:
+        sys.exit(run_query_plan_check())